@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# coding: utf-8
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from lp2jira.config import config
+
+
+class Benchmark:
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name, func, items=None):
+        started = time.perf_counter()
+        result = func()
+        wall = time.perf_counter() - started
+        count = items(result) if callable(items) else items
+        self.stages[name] = {
+            'wall_time': round(wall, 4),
+            'items': count,
+            'throughput': round(count / wall, 2) if count and wall else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_children_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+        logging.info(f'Benchmark stage {name}: {self.stages[name]}')
+        return result
+
+    def report(self, **params):
+        return {'params': params, 'stages': self.stages, 'peak_rss_mb': peak_rss_mb(),
+                'peak_children_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # With RUSAGE_CHILDREN it's peak of largest finished child process,
+    # like compile processes, counted once they exit
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 2)
+
+
+def configure(directory, project):
+    fixture_dir = os.path.join(directory, 'fixture')
+    export_dir = os.path.join(directory, 'export')
+
+    config['launchpad']['backend'] = 'fixture'
+    config['launchpad']['fixture_dir'] = fixture_dir
+    config['launchpad']['project'] = project
+    config['local']['export'] = export_dir
+    for key in ('issues', 'users', 'attachments'):
+        config['local'][key] = os.path.join(export_dir, key)
+        os.makedirs(config['local'][key])
+    config['jira']['issues'] = 'export.json'
+    config['jira']['links'] = 'export_links.json'
+    config['attachments']['manifest'] = os.path.join(export_dir, 'attachments.jsonl')
+    return fixture_dir
+
+
+def main(args):
+    benchmark = Benchmark()
+    fixture_dir = configure(args.directory, 'synthetic')
+    config['intermediate']['format'] = args.intermediate
+    config['intermediate']['store'] = args.store
+    config['intermediate']['database'] = os.path.join(config['local']['export'],
+                                                      'intermediate.sqlite')
+
+    # Imported after configuration, modules read it on import
+    from lp2jira.attachment import downloader
+    from lp2jira.config import lp
+    from lp2jira.export import ExportCompile
+    from lp2jira.history import build_history
+    from lp2jira.issue import Bug, UpdateBugs, get_releases
+    from lp2jira.synthetic import SyntheticProject
+
+    synthetic = SyntheticProject(fixture_dir, bugs=args.bugs, sub_tasks=args.sub_tasks,
+                                 comments=args.comments, activity=args.activity,
+                                 attachments=args.attachments, users=args.users,
+                                 specifications=0, seed=args.seed)
+    benchmark.stage('generate', synthetic.generate, items=args.bugs)
+
+    project = lp.projects['synthetic']
+    releases = get_releases(project)
+    tasks = [t for t in project.searchTasks() if t.bug_target_name == 'synthetic']
+
+    # Dates are parsed before, live client also returns parsed dates
+    activities = [[row for row in task.bug.activity if row.datechanged] for task in tasks]
+    benchmark.stage('history', lambda: [build_history(rows) for rows in activities],
+                    items=sum(len(rows) for rows in activities))
+    del activities
+
+    bugs = benchmark.stage('bug_create',
+                           lambda: [Bug.create(task, task.bug, releases) for task in tasks],
+                           items=len)
+    benchmark.stage('bug_export', lambda: [bug.export() for bug in bugs], items=len)
+    downloader.shutdown()
+    del bugs
+
+    benchmark.stage('compile', ExportCompile().run, items=args.bugs)
+    benchmark.stage('compile_stream', ExportCompile(stream=True).run, items=args.bugs)
+    benchmark.stage('compile_parallel', ExportCompile(processes=args.processes).run,
+                    items=args.bugs)
+
+    def jira_entries(lp_entries, key):
+        # Every second entry is already in JIRA
+        return [dict(entry, created=int(update.lp_timestamp(entry['created']) * 1e3))
+                for entry in lp_entries[::2] if key in entry]
+
+    update = UpdateBugs()
+    pairs = [(issue.get('comments', []), jira_entries(issue.get('comments', []), 'body'),
+              issue.get('history', []), jira_entries(issue.get('history', []), 'author'))
+             for issue in update.lp_issues]
+    benchmark.stage('update_diff_comments',
+                    lambda: [update.clear_comments(lp_c, jira_c) for lp_c, jira_c, _, _ in pairs],
+                    items=sum(len(p[0]) for p in pairs))
+    benchmark.stage('update_diff_history',
+                    lambda: [update.clear_history(lp_h, jira_h) for _, _, lp_h, jira_h in pairs],
+                    items=sum(len(p[2]) for p in pairs))
+
+    return benchmark.report(bugs=args.bugs, sub_tasks=args.sub_tasks, comments=args.comments,
+                            activity=args.activity, attachments=args.attachments,
+                            users=args.users, seed=args.seed, intermediate=args.intermediate,
+                            store=args.store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark export pipeline on synthetic project')
+    parser.add_argument('--bugs', type=int, default=1000)
+    parser.add_argument('--sub-tasks', type=int, default=2, help='Sub-tasks per bug')
+    parser.add_argument('--comments', type=int, default=10, help='Comments per bug')
+    parser.add_argument('--activity', type=int, default=20, help='Activity rows per bug')
+    parser.add_argument('--attachments', type=int, default=1, help='Attachments per bug')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--intermediate', choices=['pretty', 'compact'],
+                        default=config['intermediate']['format'],
+                        help='Format of issue and user files')
+    parser.add_argument('--store', choices=['files', 'sqlite'],
+                        default=config['intermediate']['store'],
+                        help='Store of issues and users before compile')
+    parser.add_argument('--processes', type=int, default=max(os.cpu_count() or 1, 2),
+                        help='Processes of parallel compile')
+    parser.add_argument('--output', help='Save JSON report to file instead of printing it')
+    parser.add_argument('--keep', help='Keep generated files in this directory')
+    args = parser.parse_args()
+
+    args.directory = args.keep or tempfile.mkdtemp(prefix='lp2jira_benchmark_')
+    logging.basicConfig(filename=os.path.join(args.directory, 'benchmark.log'),
+                        format=config['logging']['format'], level=logging.INFO)
+
+    try:
+        report = main(args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(args.directory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -5,34 +5,69 @@ import logging
 import os
 import sys
 
-from lp2jira.config import config
+from lp2jira.config import config, lp
 
 
-def main(export_bugs=True, export_blueprints=True, update_bugs=False, verify_update=False):
+def main(export_bugs=True, export_blueprints=True, update_bugs=False, verify_update=False,
+         workers=1, stream_compile=False, incremental=False, resume=False, retry_failed=False,
+         compile_processes=1, max_jobs=None, engine=None):
+    if engine:
+        # Set before first use of Launchpad, clients are created on demand
+        config['launchpad']['backend'] = engine
+
     from lp2jira.blueprint import ExportBlueprints
     from lp2jira.export import ExportCompile
     from lp2jira.issue import ExportBugs, UpdateBugs
+    from lp2jira.metrics import metrics
+    from lp2jira.scheduler import StageScheduler, budget
     from lp2jira.user import ExportSubscribers
 
-    if verify_update:
-        logging.info('===== Verify start =====')
-        UpdateBugs().verify_update()
-        logging.info('===== Verify complete =====')
-    else:
-        logging.info('===== Export start =====')
-        ExportSubscribers().run()
-        if export_bugs:
-            ExportBugs().run()
-        if export_blueprints:
-            ExportBlueprints().run()
-
-        logging.info('===== Compile export file =====')
-        ExportCompile().run()
-        logging.info('===== Export complete =====')
-        if update_bugs:
-            logging.info('===== Update start =====')
-            UpdateBugs().run()
-            logging.info('===== Update complete =====')
+    metrics.start_reporting(config['metrics'].getint('interval'))
+    try:
+        if verify_update:
+            logging.info('===== Verify start =====')
+            UpdateBugs().verify_update()
+            logging.info('===== Verify complete =====')
+        else:
+            logging.info('===== Export start =====')
+
+            def export_bugs_stage():
+                ExportBugs().run(workers=workers, incremental=incremental,
+                                 resume=resume, retry_failed=retry_failed)
+
+            def export_blueprints_stage():
+                ExportBlueprints().run(workers=workers, incremental=incremental)
+
+            def compile_stage():
+                ExportCompile(stream=stream_compile, processes=compile_processes).run()
+                logging.info('===== Export complete =====')
+
+            def update_stage():
+                logging.info('===== Update start =====')
+                UpdateBugs().run()
+                logging.info('===== Update complete =====')
+
+            # Log in before stages start, so first run authorizes only once
+            # and stage threads log in with saved token
+            lp.login()
+
+            # Subscribers, issues and blueprints are independent Launchpad reads
+            # and run at once, each with its own workers. With max_jobs
+            # their jobs share budget of max_jobs slots.
+            budget.set(max_jobs)
+            scheduler = StageScheduler()
+            exports = [scheduler.add('subscribers', ExportSubscribers().run)]
+            if export_bugs:
+                exports.append(scheduler.add('bugs', export_bugs_stage))
+            if export_blueprints:
+                exports.append(scheduler.add('blueprints', export_blueprints_stage))
+            scheduler.add('compile', compile_stage, after=exports)
+            if update_bugs:
+                scheduler.add('update', update_stage, after=['compile'])
+            scheduler.run()
+    finally:
+        metrics.stop_reporting()
+        logging.info(f'Metrics saved in: {metrics.dump()}')
 
 
 if __name__ == '__main__':
@@ -49,7 +84,28 @@ if __name__ == '__main__':
     parser.add_argument('--only-blueprints', help='Export only blueprints', action='store_true')
     parser.add_argument('--update-bugs', help='Update bugs', action='store_true')
     parser.add_argument('--verify-update', help='Verify update', action='store_true')
+    parser.add_argument('--workers', help='Number of issues exported in parallel',
+                        type=int, default=1)
+    parser.add_argument('--stream-compile', help='Write export file without loading all issues',
+                        action='store_true')
+    parser.add_argument('--compile-processes', help='Number of processes reading files in compile',
+                        type=int, default=1)
+    parser.add_argument('--max-jobs', help='Number of issues and blueprints exported at once '
+                                           'in all stages together, default: no limit',
+                        type=int)
+    parser.add_argument('--engine', help='Launchpad backend, overrides backend from export.cfg',
+                        choices=['launchpadlib', 'async', 'fixture'])
+    parser.add_argument('--incremental', help='Export only issues changed since last run',
+                        action='store_true')
+    parser.add_argument('--resume', help='Export only issues left pending by interrupted run',
+                        action='store_true')
+    parser.add_argument('--retry-failed', help='Export only issues which failed in previous run',
+                        action='store_true')
     args = parser.parse_args()
+    options = {'workers': args.workers, 'stream_compile': args.stream_compile,
+               'incremental': args.incremental, 'resume': args.resume,
+               'retry_failed': args.retry_failed, 'compile_processes': args.compile_processes,
+               'max_jobs': args.max_jobs, 'engine': args.engine}
 
     try:
         if args.verify_update:
@@ -61,13 +117,13 @@ if __name__ == '__main__':
             if args.only_bugs and args.only_blueprints:
                 raise Exception('You can use only one of --only-bugs or --only-blueprints')
             if args.update_bugs:
-                main(update_bugs=True)
+                main(update_bugs=True, **options)
             elif args.only_bugs:
-                main(export_blueprints=False)
+                main(export_blueprints=False, **options)
             elif args.only_blueprints:
-                main(export_bugs=False)
+                main(export_bugs=False, **options)
             else:
-                main()
+                main(**options)
     except KeyboardInterrupt:
         msg = "Execution has been stopped by user"
         print(msg)
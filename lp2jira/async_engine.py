@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import datetime
+import io
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote, urlencode, urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from lp2jira.config import config
+from lp2jira.fixture import FixtureCollection, FixtureEntry
+from lp2jira.http_cache import ResponseCache, get_cache, record
+from lp2jira.metrics import endpoint_name, metrics
+
+# Collections fetched together with bug, all at the same time
+BUG_COLLECTIONS = ('messages', 'activity', 'attachments', 'bug_tasks', 'duplicates')
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class AsyncEntry(FixtureEntry):
+    # JSON representation of Launchpad entry. Links and collections are
+    # fetched on first use, like attributes of launchpadlib entries.
+    def __getattr__(self, name):
+        data = self.__dict__['_data']
+        link = data.get(f'{name}_collection_link')
+        if name not in data and link:
+            data[name] = self._backend.collection(link)
+        return super().__getattr__(name)
+
+
+class AsyncProject(AsyncEntry):
+    def searchTasks(self, **params):
+        return self._backend.operation(self._data['self_link'], 'searchTasks', params)
+
+    def getSubscriptions(self):
+        return self._backend.operation(self._data['self_link'], 'getSubscriptions', {})
+
+    def getSpecification(self, name):
+        return self._backend.entry_operation(self._data['self_link'], 'getSpecification',
+                                             {'name': name})
+
+
+class HostedFile(io.BytesIO):
+    def __init__(self, content, filename):
+        super().__init__(content)
+        self.filename = filename
+
+
+class AsyncHostedFile:
+    def __init__(self, backend, link):
+        self._backend = backend
+        self.link = link
+
+    def open(self):
+        return self._backend.download(self.link)
+
+
+class AsyncAttachment(AsyncEntry):
+    @property
+    def data(self):
+        return AsyncHostedFile(self._backend, self._data['data_link'])
+
+
+def retry_delay(response, attempt):
+    # Seconds or HTTP date from Retry-After, exponential backoff without it
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return 2 ** attempt
+
+
+def _param(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class AsyncLaunchpad:
+    # Read-only Launchpad client on asyncio and aiohttp, used with
+    # backend = async. Requests run on event loop in background thread,
+    # so export threads can have any number of requests in flight at once.
+    # Bug is fetched with its messages, activity, attachments, tasks and
+    # duplicates concurrently. One client is shared by all threads.
+    # Responses are revalidated with response cache when it is enabled.
+    entry_classes = {
+        'project': AsyncProject,
+        'bug_attachment': AsyncAttachment,
+    }
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, service_root, credentials=None, connections=16, page_size=300,
+                 timeout=60, retries=3, cache=None):
+        if aiohttp is None:
+            raise RuntimeError('Launchpad backend "async" requires aiohttp: pip install aiohttp')
+
+        self.service_root = service_root
+        self.credentials = credentials
+        self.connections = connections
+        self.page_size = page_size
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.projects = FixtureCollection(lambda name: self.load(f'{self.service_root}{name}'))
+        self.people = FixtureCollection(lambda name: self.load(f'{self.service_root}~{name}'))
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='launchpad-async',
+                                        daemon=True)
+        self._thread.start()
+        self._session = self._call(self._open_session())
+        atexit.register(self.close)
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                from launchpadlib.uris import lookup_service_root
+
+                credentials = None
+                if os.path.exists('token'):
+                    from launchpadlib.credentials import Credentials
+                    credentials = Credentials.load_from_path('token')
+                root = lookup_service_root(config['launchpad']['service'])
+                cls._shared = cls(f'{root}devel/', credentials,
+                                  connections=config['launchpad'].getint('async_connections'),
+                                  page_size=config['launchpad'].getint('page_size'),
+                                  cache=get_cache())
+            return cls._shared
+
+    def close(self):
+        if self._loop.is_running():
+            self._call(self._session.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def load(self, link):
+        return self.wrap(self._call(self._load(link)))
+
+    def collection(self, link):
+        return self._call(self._collection(link))
+
+    def operation(self, link, name, params):
+        return self.wrap(self._call(self._collection(link, self._operation_params(name, params))))
+
+    def entry_operation(self, link, name, params):
+        return self.wrap(self._call(self._get_json(link, self._operation_params(name, params))))
+
+    def download(self, link):
+        # Hosted files are not kept in response cache
+        content, url = self._call(self._get(link, use_cache=False))
+        return HostedFile(content, unquote(urlsplit(url).path.rstrip('/').split('/')[-1]))
+
+    def wrap(self, value):
+        if isinstance(value, dict):
+            resource_type = value.get('resource_type_link', '').rpartition('#')[2]
+            return self.entry_classes.get(resource_type, AsyncEntry)(self, value)
+        if isinstance(value, list):
+            return [self.wrap(v) for v in value]
+        return value
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    @staticmethod
+    def _operation_params(name, params):
+        query = [('ws.op', name)]
+        for key, value in params.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            query.extend((key, _param(v)) for v in values)
+        return query
+
+    async def _open_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'Accept': 'application/json'})
+
+    def _headers(self, url):
+        headers = {}
+        if self.credentials is not None:
+            self.credentials.authorizeRequest(url, 'GET', None, headers)
+        return headers
+
+    def _in_thread(self, func, *args):
+        # SQLite response cache is used from executor threads,
+        # so disk access doesn't stop requests running on the loop
+        return self._loop.run_in_executor(None, func, *args)
+
+    async def _get(self, url, params=None, use_cache=True):
+        cache = self.cache if use_cache else None
+        key = f'{url}?{urlencode(params)}' if params else url
+        cached = await self._in_thread(cache.get, key) if cache is not None else None
+        for attempt in range(self.retries + 1):
+            started = time.monotonic()
+            headers = self._headers(url)
+            headers.update(ResponseCache.validators(cached))
+            async with self._session.get(url, params=params, headers=headers) as response:
+                content = await response.read()
+                metrics.request('launchpad', endpoint_name(response.url),
+                                time.monotonic() - started, len(content), response.status)
+                if response.status == 304 and cached is not None:
+                    record(True, len(cached['data']))
+                    return cached['data'], cached['url']
+                if response.status in RETRY_STATUSES and attempt < self.retries:
+                    await asyncio.sleep(retry_delay(response, attempt))
+                    continue
+                response.raise_for_status()
+                if cache is not None:
+                    record(False)
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+                    if etag or last_modified:
+                        await self._in_thread(cache.set, key, content, str(response.url),
+                                              etag, last_modified)
+                return content, str(response.url)
+
+    async def _get_json(self, url, params=None):
+        content, _ = await self._get(url, params)
+        return json.loads(content.decode('utf-8'))
+
+    async def _load(self, link):
+        data = await self._get_json(link)
+        if data.get('resource_type_link', '').endswith('#bug'):
+            links = [(name, data[f'{name}_collection_link']) for name in BUG_COLLECTIONS
+                     if data.get(f'{name}_collection_link')]
+            collections = await asyncio.gather(*(self._bug_collection(link, data.get('http_etag'))
+                                                 for _, link in links))
+            for (name, _), entries in zip(links, collections):
+                data[name] = entries
+        return data
+
+    async def _bug_collection(self, link, etag):
+        # Collection is reused from cache while bug has the same etag
+        if self.cache is None:
+            return await self._collection(link)
+        entries = await self._in_thread(self.cache.get_entries, link, etag)
+        if entries is None:
+            entries = await self._collection(link)
+            await self._in_thread(self.cache.set_entries, link, etag, entries)
+        return entries
+
+    async def _collection(self, link, params=None):
+        page = await self._get_json(link, list(params or []) + [('ws.size', self.page_size)])
+        entries = list(page.get('entries', []))
+        while page.get('next_collection_link'):
+            page = await self._get_json(page['next_collection_link'])
+            entries.extend(page.get('entries', []))
+        return entries
@@ -1,48 +1,178 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from lp2jira.config import config
-from lp2jira.utils import prepare_attachment_name, clean_id
+from lp2jira.collection import iter_collection
+from lp2jira.config import config, lp
+from lp2jira.metrics import metrics
+from lp2jira.utils import atomic_write, prepare_attachment_name, clean_id
+
+
+class AttachmentDownloader:
+    # Attachments are downloaded in background threads while issue is created.
+    # Files are written to temporary file and renamed when complete. Size and
+    # sha256 of every file are stored in manifest, so re-run skips complete files.
+    def __init__(self):
+        self.workers = config['attachments'].getint('workers')
+        self.buffer_size = config['attachments'].getint('buffer_size')
+        self.verify = config['attachments'].getboolean('verify')
+        self.manifest_file = config['attachments']['manifest']
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manifest = None
+
+    def submit(self, bug_id, attachment_link):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor.submit(self.download, bug_id, attachment_link)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def download(self, bug_id, attachment_link):
+        # Whole job in background thread, including skipped files
+        with metrics.timer('attachments.download'):
+            return self._download(bug_id, attachment_link)
+
+    def _download(self, bug_id, attachment_link):
+        record = self._get_record(attachment_link)
+        if record is not None and self._is_complete(record):
+            logging.debug(f'Attachment {record["file"]} already exists, skipping')
+            metrics.count('attachments.skipped')
+            return self._metadata(record)
+
+        # Attachment is loaded again, because launchpad client of issue
+        # can't be shared between threads.
+        attachment = lp.load(attachment_link)
+        f_in = attachment.data.open()
+        f_name = prepare_attachment_name(f'{bug_id}_{f_in.filename}')
+        filename = os.path.normpath(os.path.join(config['local']['attachments'], f_name))
+
+        with metrics.timer('attachments.write'):
+            size, checksum = self._write(f_in, filename)
+        metrics.count('attachments.downloaded')
+        metrics.count('attachments.bytes', size)
+        logging.debug(f'Attachment {f_name} export success')
+
+        attacher = ""
+        created = ""
+        try:
+            attacher = clean_id(attachment.message.owner_link)
+            created = attachment.message.date_created.isoformat()
+        except Exception as exc:
+            logging.warning(f"Failed details for attachment {f_name}. Attacher: {attacher}, created: {created}.")
+            logging.warning("Attachment added with default data.")
+            logging.warning(exc, exc_info=True)
+
+        record = {'link': attachment_link, 'name': prepare_attachment_name(f_in.filename),
+                  'file': f_name, 'size': size, 'sha256': checksum,
+                  'attacher': attacher, 'created': created}
+        self._add_record(record)
+        return self._metadata(record)
+
+    def _write(self, f_in, filename):
+        checksum = hashlib.sha256()
+        size = 0
+        with atomic_write(filename, 'wb', suffix='.part') as f_out:
+            while True:
+                buff = f_in.read(self.buffer_size)
+                if not buff:
+                    break
+                f_out.write(buff)
+                checksum.update(buff)
+                size += len(buff)
+        return size, checksum.hexdigest()
+
+    def _is_complete(self, record):
+        filename = os.path.join(config['local']['attachments'], record['file'])
+        try:
+            if os.path.getsize(filename) != record['size']:
+                return False
+        except OSError:
+            return False
+
+        if not self.verify:
+            return True
+
+        checksum = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for buff in iter(lambda: f.read(self.buffer_size), b''):
+                checksum.update(buff)
+        return checksum.hexdigest() == record['sha256']
+
+    @staticmethod
+    def _metadata(record):
+        return {
+            'name': record['name'],
+            'attacher': record['attacher'],
+            'created': record['created'],
+            'uri': f'{config["jira"]["attachments_url"].rstrip("/")}/{record["file"]}'
+        }
+
+    def _load_manifest(self):
+        if self._manifest is None:
+            self._manifest = {}
+            if os.path.exists(self.manifest_file):
+                with open(self.manifest_file, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Last line can be cut by interrupted run
+                            continue
+                        self._manifest[record['link']] = record
+        return self._manifest
+
+    def _get_record(self, attachment_link):
+        with self._lock:
+            return self._load_manifest().get(attachment_link)
+
+    def _add_record(self, record):
+        with self._lock:
+            self._load_manifest()[record['link']] = record
+            with open(self.manifest_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+downloader = AttachmentDownloader()
 
 
 def create_attachments(bug):
+    # Only lists attachments and submits downloads, they are timed
+    # in background as attachments.download
+    with metrics.timer('stage.submit_attachments'):
+        return [(attachment.self_link, downloader.submit(bug.id, attachment.self_link))
+                for attachment in iter_collection(bug.attachments, 'attachments',
+                                                  getattr(bug, 'http_etag', None))]
+
+
+def collect_attachments(bug_id, pending):
     attachments = []
-    for attachment in bug.attachments:
+    for attachment_link, future in pending:
         try:
-            f_in = attachment.data.open()
-            f_name = prepare_attachment_name(f'{bug.id}_{f_in.filename}')
-            filename = os.path.normpath(os.path.join(config['local']['attachments'], f_name))
-
-            if os.path.exists(filename):
-                logging.debug(f'Attachment {f_name} already exists, skipping: "{filename}"')
-            else:
-                with open(filename, 'wb') as f_out:
-                    while True:
-                        buff = f_in.read(1024)
-                        if buff:
-                            f_out.write(buff)
-                        else:
-                            break
-                logging.debug(f'Attachment {f_name} export success')
-
-                attacher = ""
-                created = ""
-                try:
-                    attacher = clean_id(attachment.message.owner_link)
-                    created = attachment.message.date_created.isoformat()
-                except Exception as exc:
-                    logging.warning(f"Failed details for attachment {f_name}. Attacher: {attacher}, created: {created}.")
-                    logging.warning("Attachment added with default data.")
-                    logging.warning(exc, exc_info=True)
-
-                attachments.append({
-                    'name': prepare_attachment_name(f_in.filename),
-                    'attacher': attacher,
-                    'created': created,
-                    'uri': f'{config["jira"]["attachments_url"].rstrip("/")}/{f_name}'
-                })
+            attachments.append(future.result())
         except Exception as exc:
-            logging.warning(f"Download attachment failed. Bug: {bug.id}, attachment {attachment} skipped")
+            logging.warning(f"Download attachment failed. Bug: {bug_id}, attachment {attachment_link} skipped")
             logging.warning(exc, exc_info=True)
     return attachments
+
+
+def cancel_attachments(pending):
+    # Downloads of issue which won't be exported are cancelled,
+    # ones already running are waited for and their results dropped
+    for _, future in pending:
+        future.cancel()
+    for _, future in pending:
+        if not future.cancelled():
+            try:
+                future.result()
+            except Exception:
+                pass
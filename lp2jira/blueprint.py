@@ -1,15 +1,44 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
-import os
-import re
-
-import requests
-from tqdm import tqdm
+import types
 
+from lp2jira.collection import iter_collection
 from lp2jira.config import config, lp
 from lp2jira.export import Export
 from lp2jira.issue import Issue
-from lp2jira.utils import bug_template, json_dump, translate_blueprint_status, clean_id
+from lp2jira.mapping import mappings
+from lp2jira.state import ExportState
+from lp2jira.store import get_store
+from lp2jira.utils import (bug_template, clean_id, get_custom_fields,
+                           translate_blueprint_status)
+
+
+class SpecSnapshot:
+    # Copy of specification fields used by export, taken at once in thread
+    # which loaded specification. Assignee is known from its link,
+    # person itself is never fetched.
+    fields = ['name', 'title', 'summary', 'whiteboard', 'workitems_text', 'owner_link',
+              'assignee_link', 'priority', 'date_created']
+
+    def __init__(self, spec):
+        for field in self.fields + self._mapped_fields():
+            if field not in self.__dict__ and hasattr(spec, field):
+                setattr(self, field, getattr(spec, field))
+
+    @property
+    def assignee(self):
+        link = getattr(self, 'assignee_link', None)
+        return types.SimpleNamespace(name=clean_id(link)) if link else None
+
+    @staticmethod
+    def _mapped_fields():
+        # Fields read by status mapping and custom fields
+        fields = [field for rule, _ in mappings.get('blueprint') for field in rule.fields]
+        if config['DEFAULT'].getboolean('export_custom_fields'):
+            fields.extend(get_custom_fields())
+        return fields
 
 
 class Blueprint(Issue):
@@ -17,8 +46,6 @@ class Blueprint(Issue):
 
     @classmethod
     def create(cls, spec):
-        project = lp.projects[config['launchpad']['project']]
-
         status = translate_blueprint_status(spec)
         description = f'{spec.summary}\n\n{spec.whiteboard}\n\n{spec.workitems_text}'
         custom_fields = Issue.create_custom_fields(spec)
@@ -31,20 +58,22 @@ class Blueprint(Issue):
     def export(self):
         self._export_related_users()
 
-        filename = self.filename(self.issue_id)
-        if self.exists(filename):
-            logging.debug(f'Blueprint {self.issue_id} already exists, skipping: "{filename}"')
+        if self.exists(self.issue_id):
+            logging.debug(f'Blueprint {self.issue_id} already exists, skipping')
             return True
 
         export_bug = bug_template()
         export_bug['projects'][0]['issues'] = [self._dump()]
         export_bug['links'] = []
-        with open(filename, 'w') as f:
-            json_dump(export_bug, f)
+        get_store('issues').write(self.issue_id, export_bug, issue_type=self.issue_type)
 
         logging.debug(f'Blueprint {self.issue_id} export success')
         return True
 
+    def fingerprint(self):
+        data = json.dumps(self._dump(), sort_keys=True).encode()
+        return hashlib.sha256(data).hexdigest()
+
 
 class ExportBlueprint(Export):
     def __init__(self):
@@ -52,16 +81,33 @@ class ExportBlueprint(Export):
 
 
 class ExportBlueprints(ExportBlueprint):
-    def run(self):
+    def run(self, workers=1, incremental=False):
         logging.info('===== Export: Blueprints =====')
 
         project = lp.projects[config['launchpad']['project']]
         specs = project.all_specifications
-        
+        state = ExportState() if incremental else None
+        # Workers get plain copies, entries stay in thread which loaded them
+        snapshots = (SpecSnapshot(spec) for spec in iter_collection(specs, 'all_specifications'))
+
+        def export_spec(spec):
+            if state is None:
+                return super(ExportBlueprints, self).run(spec)
+
+            # Specifications have no modification date, exported content is compared
+            blueprint = self.create_entity(spec)
+            fingerprint = blueprint.fingerprint()
+            if state.get_spec(blueprint.issue_id) != fingerprint:
+                Blueprint.remove(blueprint.issue_id)
+            self.export_created(blueprint)
+            state.set_spec(blueprint.issue_id, fingerprint)
+            return True
+
         failed_specs = []
         counter = 0
-        for index, spec in enumerate(tqdm(specs, desc='Export blueprints')):
-            if super().run(spec):
+        for index, spec, success in self.run_many(export_spec, snapshots, workers=workers,
+                                                  desc='Export blueprints', total=len(specs)):
+            if success:
                 counter += 1
             else:
                 failed_specs.append(f'index: {index}, name: {spec.name}')
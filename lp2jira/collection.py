@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lazr.uri import URI
+
+from lp2jira.config import config, lp
+from lp2jira.http_cache import get_cache
+from lp2jira.metrics import metrics
+
+
+class CollectionFetcher:
+    # launchpadlib iterates collections page by page with default page size,
+    # each page is requested only when previous one is consumed. Fetcher asks
+    # for large pages and requests next page in background while current one
+    # is processed. Next pages are fetched by thread local client of prefetch
+    # thread, entries are bound to client of the collection. Collection of
+    # entry with etag is kept in response cache and reused while entry
+    # has the same etag.
+    def __init__(self):
+        self.page_size = config['launchpad'].getint('page_size')
+        self.workers = config['launchpad'].getint('prefetch_workers')
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, url):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor.submit(self.fetch, url)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    @staticmethod
+    def fetch(url):
+        started = time.monotonic()
+        page = lp._browser.get(URI(url))
+        if isinstance(page, bytes):
+            page = page.decode('utf-8')
+        return json.loads(page), time.monotonic() - started
+
+    def iterate(self, collection, name, etag=None):
+        wadl_resource = getattr(collection, '_wadl_resource', None)
+        if wadl_resource is None:
+            # Collections of fixture backend are plain lists
+            yield from collection
+            return
+
+        cache = get_cache() if etag and wadl_resource.representation is None else None
+        if cache is not None:
+            cached = cache.get_entries(wadl_resource.url, etag)
+            if cached is not None:
+                metrics.count(f'launchpad.collection.{name}.cached')
+                yield from collection._convert_dicts_to_entries(cached)
+                return
+            collected = []
+
+        pages = entries = 0
+        fetch_time = wait_time = 0.0
+        page = wadl_resource.representation
+        pending = None
+        try:
+            if page is None:
+                # First page is fetched by calling thread, prefetch threads
+                # only fetch next pages of long collections
+                page, fetch_time = self.fetch(self._page_url(collection, wadl_resource.url))
+                wait_time = fetch_time
+                pages += 1
+
+            while True:
+                if pending is not None:
+                    started = time.monotonic()
+                    page, elapsed = pending.result()
+                    wait_time += time.monotonic() - started
+                    fetch_time += elapsed
+                    pages += 1
+
+                next_link = page.get('next_collection_link')
+                pending = self.submit(self._page_url(collection, next_link)) if next_link else None
+
+                page_entries = page.get('entries', [])
+                entries += len(page_entries)
+                if cache is not None:
+                    collected.extend(page_entries)
+                yield from collection._convert_dicts_to_entries(page_entries)
+                if pending is None:
+                    break
+            if cache is not None:
+                cache.set_entries(wadl_resource.url, etag, collected)
+        finally:
+            metrics.count(f'launchpad.collection.{name}.pages', pages)
+            metrics.count(f'launchpad.collection.{name}.entries', entries)
+            metrics.observe(f'launchpad.collection.{name}.wait', wait_time)
+            logging.debug(f'Collection {name}: {entries} entries in {pages} pages, '
+                          f'fetch {fetch_time:.2f}s, waited {wait_time:.2f}s')
+
+    def _page_url(self, collection, url):
+        return collection._with_url_query_variable_set(url, 'ws.size', self.page_size)
+
+
+fetcher = CollectionFetcher()
+
+
+def iter_collection(collection, name, etag=None):
+    return fetcher.iterate(collection, name, etag)
@@ -1,11 +1,41 @@
 # -*- coding: utf-8 -*-
 import configparser
-
-from launchpadlib.launchpad import Launchpad
+import threading
 
 config = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
 config.read('export.cfg')
 
-lp = Launchpad.login_with('LP2JIRA', config['launchpad']['service'],
-                          launchpadlib_dir=config['launchpad']['cache_dir'],
-                          version='devel', credentials_file='token')
+
+def login():
+    if config['launchpad']['backend'] == 'fixture':
+        from lp2jira.fixture import FixtureLaunchpad
+        return FixtureLaunchpad(config['launchpad']['fixture_dir'])
+    if config['launchpad']['backend'] == 'async':
+        from lp2jira.async_engine import AsyncLaunchpad
+        return AsyncLaunchpad.shared()
+
+    from launchpadlib.launchpad import Launchpad
+    from lp2jira import service_cache
+    service_cache.install()
+    return Launchpad.login_with('LP2JIRA', config['launchpad']['service'],
+                                launchpadlib_dir=config['launchpad']['cache_dir'],
+                                version='devel', credentials_file='token')
+
+
+class ThreadLocalLaunchpad(threading.local):
+    # launchpadlib objects share one httplib2 connection per client,
+    # which can't be used from many threads. Every thread gets its own client.
+    # Client is created on first use, commands which don't read from
+    # Launchpad never log in.
+    client = None
+
+    def login(self):
+        if self.client is None:
+            self.client = login()
+        return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.login(), name)
+
+
+lp = ThreadLocalLaunchpad()
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import collections
 import json
 import logging
 import os
-from json import JSONDecodeError
+import tempfile
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
 
 from tqdm import tqdm
 
 from lp2jira.config import config
-from lp2jira.utils import bug_template, json_dump
+from lp2jira.metrics import metrics
+from lp2jira.scheduler import budget
+from lp2jira.store import get_store
+from lp2jira.utils import bug_template, json_dump, json_dump_stream, json_render
 
 
 class Export:
@@ -19,53 +25,172 @@ class Export:
 
     def run(self, *args, **kwargs):
         try:
-            entity = self.entity.create(*args, **kwargs)
-            entity.export()
+            self.export_entity(*args, **kwargs)
             return True
         except Exception as exc:
             logging.error(f'{self.entity.__name__} export failed for {args} {kwargs}')
             logging.exception(exc)
             return False
 
+    def export_entity(self, *args, **kwargs):
+        # Like run, but errors are raised to caller
+        self.export_created(self.create_entity(*args, **kwargs))
 
-class ExportCompile(Export):
+    def create_entity(self, *args, **kwargs):
+        stage = f'stage.{self.entity.__name__.lower()}'
+        try:
+            with metrics.timer(f'{stage}.create'):
+                return self.entity.create(*args, **kwargs)
+        except Exception:
+            metrics.count(f'{stage}.failed')
+            raise
+
+    def export_created(self, entity):
+        stage = f'stage.{self.entity.__name__.lower()}'
+        try:
+            with metrics.timer(f'{stage}.export'):
+                entity.export()
+        except Exception:
+            metrics.count(f'{stage}.failed')
+            raise
+        metrics.count(f'{stage}.exported')
+
+    def run_many(self, worker, jobs, workers=1, desc=None, total=None):
+        # Yields (index, job, success) for every job. With more than one worker
+        # results come in completion order, at most a few jobs per worker are
+        # queued at any time.
+        if workers <= 1:
+            for index, job in enumerate(tqdm(jobs, desc=desc, total=total)):
+                yield index, job, self._run_job(worker, job)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tqdm(desc=desc, total=total) as progress:
+            pending = {}
+            for index, job in enumerate(jobs):
+                pending[executor.submit(self._run_job, worker, job)] = (index, job)
+                if len(pending) >= workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        progress.update()
+                        yield pending.pop(future) + (future.result(),)
+
+            for future in as_completed(list(pending)):
+                progress.update()
+                yield pending.pop(future) + (future.result(),)
+
+    def _run_job(self, worker, job):
+        try:
+            with budget.slot():
+                return worker(job)
+        except Exception as exc:
+            logging.error(f'{self.entity.__name__} export failed for {job}')
+            logging.exception(exc)
+            return False
+
+
+class VersionIndex:
+    # Every exported issue carries a full list of releases.
+    # Versions are merged by name, keeping the most complete data.
     def __init__(self):
+        self.versions = {}
+        self.collapsed = 0
+
+    def __len__(self):
+        return len(self.versions)
+
+    def add(self, version):
+        known = self.versions.get(version['name'])
+        if known is None:
+            self.versions[version['name']] = dict(version)
+            return
+
+        self.collapsed += 1
+        for key, value in version.items():
+            if value and not known.get(key):
+                known[key] = value
+
+    def extend(self, versions):
+        for version in versions:
+            self.add(version)
+
+    def values(self):
+        return list(self.versions.values())
+
+    def merge(self, other):
+        self.extend(other.values())
+        self.collapsed += other.collapsed
+
+
+def compile_shard(kind, store, refs):
+    # Runs in process of compile pool. Items of shard are parsed, issues
+    # and users rendered to JSON, versions merged and links collected.
+    shard = {'files': len(refs), 'errors': [], 'items': [], 'links': [],
+             'versions': VersionIndex()}
+    for ref, data in store.load(refs):
+        if data is None:
+            shard['errors'].append(ref)
+            continue
+        if kind == 'users':
+            shard['items'].append(data)
+        else:
+            shard['items'].extend(data['projects'][0]['issues'])
+            shard['versions'].extend(data['projects'][0]['versions'])
+            shard['links'].extend(data['links'])
+    shard['items'] = [json_render(item) for item in shard['items']]
+    return shard
+
+
+class ExportCompile(Export):
+    # Number of issues or users parsed by one task of process pool
+    shard_size = 200
+
+    def __init__(self, stream=False, processes=1):
         super().__init__(entity=None)
+        self.stream = stream
+        self.processes = processes
+        self.counters = {}
 
     def run(self):
         logging.info('===== Compile export file =====')
 
+        filename = os.path.join(config['local']['export'], config['jira']['issues'])
+        links_file = os.path.join(config['local']['export'], config['jira']['links'])
+
+        self.counters = {'issues': 0, 'links': 0, 'users': 0}
+        self.versions = VersionIndex()
+        with metrics.timer('stage.compile'):
+            if self.processes > 1:
+                self._compile_parallel(filename, links_file)
+            elif self.stream:
+                self._compile_stream(filename, links_file)
+            else:
+                self._compile(filename, links_file)
+
+        logging.info(f'===== Export summary =====')
+        logging.info(f'Compiled issues: {self.counters["issues"]}')
+        logging.info(f'Compiled links: {self.counters["links"]}')
+        logging.info(f'Compiled users: {self.counters["users"]}')
+        logging.info(f'Compiled versions: {len(self.versions)}, '
+                     f'duplicates collapsed: {self.versions.collapsed}')
+        logging.info(f'Exported data saved in: {filename}')
+
+    def _compile(self, filename, links_file):
         export_bug = bug_template()
         export_links = bug_template()
 
-
-        for filename in tqdm(os.listdir(config['local']['issues']), desc='Compile issues'):
-            with open(os.path.join(config['local']['issues'], filename), 'r') as f:
-                try:
-                    issue = json.load(f)
-                except JSONDecodeError:
-                    logging.error(f'Export error in issue: {filename}')
-                    continue
+        for issue in self._load('issues', desc='Compile issues'):
             export_bug['projects'][0]['issues'].extend(issue['projects'][0]['issues'])
-            export_bug['projects'][0]['versions'].extend(issue['projects'][0]['versions'])
+            self.versions.extend(issue['projects'][0]['versions'])
             export_links['links'].extend(issue['links'])
 
-        for filename in tqdm(os.listdir(config['local']['users']), desc='Compile users'):
-            with open(os.path.join(config['local']['users'], filename), 'r') as f:
-                try:
-                    user = json.load(f)
-                except JSONDecodeError:
-                    logging.error('Export error in user: %s' % filename)
-                    continue
+        for user in self._load('users', desc='Compile users'):
             export_bug['users'].append(user)
 
-        logging.info(f'===== Export summary =====')
-        logging.info(f'Compiled issues: {len(export_bug["projects"][0]["issues"])}')
-        logging.info(f'Compiled links: {len(export_bug["links"])}')
-        logging.info(f'Compiled users: {len(export_bug["users"])}')
-
-        filename = os.path.join(config['local']['export'], config['jira']['issues'])
-        links_file = os.path.join(config['local']['export'], config['jira']['links'])
+        export_bug['projects'][0]['versions'] = self.versions.values()
+        self.counters['issues'] = len(export_bug['projects'][0]['issues'])
+        self.counters['links'] = len(export_links['links'])
+        self.counters['users'] = len(export_bug['users'])
 
         with open(filename, 'w') as f:
             json_dump(export_bug, f)
@@ -73,4 +198,109 @@ class ExportCompile(Export):
         with open(links_file, 'w') as f:
             json_dump(export_links, f)
 
-        logging.info(f'Exported data saved in: {filename}')
+    def _compile_stream(self, filename, links_file):
+        # Issues are written while issue files are read. Links are spooled
+        # to temporary file and written after issues.
+        with tempfile.TemporaryFile('w+') as links_spool:
+
+            def issues():
+                for issue in self._load('issues', desc='Compile issues'):
+                    self.versions.extend(issue['projects'][0]['versions'])
+                    for link in issue['links']:
+                        links_spool.write(json.dumps(link) + '\n')
+                        self.counters['links'] += 1
+                    for item in issue['projects'][0]['issues']:
+                        self.counters['issues'] += 1
+                        yield item
+
+            def users():
+                for user in self._load('users', desc='Compile users'):
+                    self.counters['users'] += 1
+                    yield user
+
+            export_bug = bug_template()
+            export_bug['projects'][0]['issues'] = issues()
+            export_bug['projects'][0]['versions'] = self._versions()
+            export_bug['users'] = users()
+            with open(filename, 'w') as f:
+                json_dump_stream(export_bug, f)
+
+            export_links = bug_template()
+            export_links['links'] = self._unspool(links_spool)
+            with open(links_file, 'w') as f:
+                json_dump_stream(export_links, f)
+
+    def _compile_parallel(self, filename, links_file):
+        # Stored items are split into shards of sorted references, parsed and
+        # rendered in process pool. Shards are merged in order, so output is the same
+        # as of _compile for any number of processes. Issues are written
+        # as shards come, like in _compile_stream.
+        with ProcessPoolExecutor(max_workers=self.processes) as executor, \
+                tempfile.TemporaryFile('w+') as links_spool:
+
+            def issues():
+                for shard in self._map_shards(executor, 'issues', desc='Compile issues'):
+                    self.versions.merge(shard['versions'])
+                    for link in shard['links']:
+                        links_spool.write(json.dumps(link) + '\n')
+                    self.counters['links'] += len(shard['links'])
+                    self.counters['issues'] += len(shard['items'])
+                    yield from shard['items']
+
+            def users():
+                for shard in self._map_shards(executor, 'users', desc='Compile users'):
+                    self.counters['users'] += len(shard['items'])
+                    yield from shard['items']
+
+            export_bug = bug_template()
+            export_bug['projects'][0]['issues'] = issues()
+            export_bug['projects'][0]['versions'] = self._versions()
+            export_bug['users'] = users()
+            with open(filename, 'w') as f:
+                json_dump_stream(export_bug, f)
+
+            export_links = bug_template()
+            export_links['links'] = self._unspool(links_spool)
+            with open(links_file, 'w') as f:
+                json_dump_stream(export_links, f)
+
+    def _map_shards(self, executor, kind, desc):
+        # Only a few shards per process are in flight, results in order
+        store = get_store(kind)
+        refs = store.refs()
+        with tqdm(total=len(refs), desc=desc) as progress:
+            pending = collections.deque()
+            for start in range(0, len(refs), self.shard_size):
+                pending.append(executor.submit(compile_shard, kind, store,
+                                               refs[start:start + self.shard_size]))
+                if len(pending) >= self.processes * 2:
+                    yield self._shard_result(kind, pending.popleft(), progress)
+            while pending:
+                yield self._shard_result(kind, pending.popleft(), progress)
+
+    @staticmethod
+    def _shard_result(kind, future, progress):
+        shard = future.result()
+        for filename in shard['errors']:
+            logging.error(f'Export error in {kind[:-1]}: {filename}')
+        progress.update(shard['files'])
+        return shard
+
+    def _versions(self):
+        # Evaluated after all issues are written
+        yield from self.versions.values()
+
+    @staticmethod
+    def _unspool(spool):
+        spool.seek(0)
+        for line in spool:
+            yield json.loads(line)
+
+    @staticmethod
+    def _load(kind, desc):
+        store = get_store(kind)
+        for ref, data in store.load(tqdm(store.refs(), desc=desc)):
+            if data is None:
+                logging.error(f'Export error in {kind[:-1]}: {ref}')
+                continue
+            yield data
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import functools
+import io
+import json
+import os
+import re
+
+import dateutil.parser
+
+# Launchpad backend serving data recorded or generated on disk, it has just
+# enough of launchpadlib API for export. Directory layout:
+#
+#   projects/<name>.json    project with releases, milestones, subscriptions,
+#                           specifications and tasks
+#   bugs/<id>.json          bug with messages, activity, attachments,
+#                           bug_tasks and duplicates
+#   people/<name>.json      person
+#   files/<path>            attachment data, referenced by "data_file"
+#
+# Entities have the same attributes as Launchpad representations.
+# Attributes ending with "_link" are resolved to entities, nested dicts and
+# lists of dicts are served as entities, dates are parsed on first access.
+# Projects and attachments need "resource_type" set to "project"
+# and "bug_attachment".
+
+SERVICE_ROOT = 'https://api.launchpad.net/devel/'
+
+LINK_PATTERNS = [
+    ('person', re.compile(r'^~(?P<name>[^/]+)$')),
+    ('bug', re.compile(r'^bugs/(?P<id>\d+)$')),
+    ('bug_entry', re.compile(r'^bugs/(?P<id>\d+)/.+$')),
+    ('task', re.compile(r'^(?P<project>[^/~]+)(/[^/]+)?/\+bug/(?P<id>\d+)$')),
+    ('project_entry', re.compile(r'^(?P<project>[^/~]+)/\+(milestone|spec)/[^/]+$')),
+    ('project', re.compile(r'^(?P<project>[^/~+]+)$')),
+]
+
+
+class FixtureEntry:
+    def __init__(self, backend, data):
+        self._backend = backend
+        self._data = data
+
+    def __getattr__(self, name):
+        data = self.__dict__['_data']
+        if name in data:
+            value = data[name]
+        elif f'{name}_link' in data:
+            link = data[f'{name}_link']
+            return self._backend.load(link) if link else None
+        else:
+            raise AttributeError(f"'{data.get('resource_type', 'entry')}' object "
+                                 f"has no attribute '{name}'")
+
+        if name.startswith('date') and isinstance(value, str):
+            value = dateutil.parser.isoparse(value)
+            data[name] = value
+        return self._backend.wrap(value)
+
+    def __repr__(self):
+        return f'<fixture {self._data.get("self_link")}>'
+
+
+class FixtureFile(io.BytesIO):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.filename = os.path.basename(path)
+
+
+class FixtureHostedFile:
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        return FixtureFile(self.path)
+
+
+class FixtureProject(FixtureEntry):
+    def searchTasks(self, status=None, modified_since=None, **kwargs):
+        tasks = self._data['tasks']
+        if status is not None:
+            tasks = [t for t in tasks if t['status'] in status]
+        if modified_since is not None:
+            tasks = [t for t in tasks
+                     if dateutil.parser.isoparse(t['date_last_updated']) > modified_since]
+        return self._backend.wrap(tasks)
+
+    def getSubscriptions(self):
+        return self.subscriptions
+
+    @property
+    def all_specifications(self):
+        return self.specifications
+
+    def getSpecification(self, name):
+        for spec in self._data['specifications']:
+            if spec['name'] == name:
+                return self._backend.wrap(spec)
+        raise KeyError(name)
+
+
+class FixtureAttachment(FixtureEntry):
+    @property
+    def data(self):
+        return FixtureHostedFile(os.path.join(self._backend.directory, 'files',
+                                              self._data['data_file']))
+
+
+class FixtureCollection:
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getitem__(self, name):
+        return self.loader(name)
+
+
+class FixtureLaunchpad:
+    entry_classes = {
+        'project': FixtureProject,
+        'bug_attachment': FixtureAttachment,
+    }
+
+    def __init__(self, directory, cache_size=1024):
+        self.directory = directory
+        self.projects = FixtureCollection(self._project)
+        self.people = FixtureCollection(self._person)
+        self._read = functools.lru_cache(maxsize=cache_size)(self._read)
+
+    def _read(self, *path):
+        with open(os.path.join(self.directory, *path), 'r') as f:
+            return json.load(f)
+
+    def wrap(self, value):
+        if isinstance(value, dict):
+            entry_class = self.entry_classes.get(value.get('resource_type'), FixtureEntry)
+            return entry_class(self, value)
+        if isinstance(value, list):
+            return [self.wrap(v) for v in value]
+        return value
+
+    def _project(self, name):
+        return self.wrap(self._read('projects', f'{name}.json'))
+
+    def _person(self, name):
+        return self.wrap(self._read('people', f'{name}.json'))
+
+    def _bug(self, bug_id):
+        return self._read('bugs', f'{bug_id}.json')
+
+    def load(self, link):
+        path = link[len(SERVICE_ROOT):] if link.startswith(SERVICE_ROOT) else link
+        for kind, pattern in LINK_PATTERNS:
+            match = pattern.match(path)
+            if match is None:
+                continue
+
+            if kind == 'person':
+                return self._person(match.group('name'))
+            if kind == 'bug':
+                return self.wrap(self._bug(match.group('id')))
+            if kind == 'bug_entry':
+                bug = self._bug(match.group('id'))
+                return self._find(link, bug['messages'], bug['attachments'])
+            if kind == 'task':
+                bug = self._bug(match.group('id'))
+                return self._find(link, bug['bug_tasks'])
+            if kind == 'project_entry':
+                project = self._read('projects', f'{match.group("project")}.json')
+                return self._find(link, project['milestones'], project['specifications'])
+            if kind == 'project':
+                return self._project(match.group('project'))
+        raise KeyError(link)
+
+    def _find(self, link, *collections):
+        for collection in collections:
+            for data in collection:
+                if data['self_link'] == link:
+                    return self.wrap(data)
+        raise KeyError(link)
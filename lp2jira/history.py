@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from lp2jira.utils import (clean_id, get_user_data_from_activity_changed,
+                           translate_priority, translate_status)
+
+
+def _translate(translate, value):
+    return translate(value) if value else value
+
+
+def convert_plain(field):
+    def convert(old, new):
+        return {'fieldType': 'jira', 'field': field,
+                'from': None, 'fromString': old, 'to': None, 'toString': new}
+    return convert
+
+
+def convert_translated(field, translate):
+    def convert(old, new):
+        return {'fieldType': 'jira', 'field': field,
+                'from': None, 'fromString': _translate(translate, old),
+                'to': None, 'toString': _translate(translate, new)}
+    return convert
+
+
+def convert_user(field):
+    def convert(old, new):
+        old_display, old_name = get_user_data_from_activity_changed(old)
+        new_display, new_name = get_user_data_from_activity_changed(new)
+        return {'fieldType': 'jira', 'field': field,
+                'from': old_name, 'fromString': old_display,
+                'to': new_name, 'toString': new_display}
+    return convert
+
+
+# Changes of whole bug, whatchanged is name of changed field
+BUG_CONVERTERS = {
+    'tags': convert_plain('labels'),
+    'summary': convert_plain('summary'),
+}
+
+# Changes of bug task, whatchanged is "<bug_target_name>: <field>"
+TASK_CONVERTERS = {
+    'assignee': convert_user('assignee'),
+    'status': convert_translated('status', translate_status),
+    'importance': convert_translated('priority', translate_priority),
+    'milestone': convert_plain('Fix Version'),
+}
+
+
+def build_history(activities):
+    # Returns history of bug and history of every bug task by its target name
+    history = []
+    task_history = {}
+    for activity in activities:
+        whatchanged = activity.whatchanged
+        converter = BUG_CONVERTERS.get(whatchanged)
+        if converter is not None:
+            records = history
+        else:
+            target, _, field = whatchanged.partition(': ')
+            converter = TASK_CONVERTERS.get(field)
+            if converter is None:
+                continue
+            records = task_history.setdefault(target, [])
+
+        records.append({
+            'author': clean_id(activity.person_link),
+            'created': activity.datechanged.isoformat(),
+            'items': [converter(activity.oldvalue, activity.newvalue)]
+        })
+    return history, task_history
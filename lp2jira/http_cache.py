@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from lp2jira.config import config
+from lp2jira.metrics import metrics
+
+# Responses of Launchpad kept between runs in SQLite database, keyed by URL.
+# Entries and pages are revalidated with ETag or Last-Modified, so unchanged
+# resources are answered with 304 and no body. Collections of bug are stored
+# with http_etag of bug, they are reused without any request as long as bug
+# has the same etag. Least recently used responses are removed when database
+# grows over response_cache_size.
+
+
+class ResponseCache:
+    def __init__(self, filename, max_size):
+        self.filename = filename
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = None
+        self._size = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.filename, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                             '(key TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT, '
+                             'data BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                             'ON responses (accessed)')
+            self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) '
+                                          'FROM responses').fetchone()[0]
+        return self._db
+
+    def get(self, key):
+        # Returns dict with data, url, etag and last_modified or None
+        with self._lock:
+            row = self.db.execute('SELECT data, url, etag, last_modified FROM responses '
+                                  'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                            (time.time(), key))
+        return {'data': bytes(row[0]), 'url': row[1], 'etag': row[2], 'last_modified': row[3]}
+
+    def set(self, key, data, url=None, etag=None, last_modified=None):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            '(key, url, etag, last_modified, data, size, accessed) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (key, url, etag, last_modified, sqlite3.Binary(data), len(data),
+                             time.time()))
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_size:
+                self._evict()
+        metrics.count('http_cache.stored')
+
+    def delete(self, key):
+        with self._lock:
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._size -= old[0]
+
+    def _evict(self):
+        # Oldest responses are removed until cache is 10% below its limit
+        target = self.max_size * 0.9
+        removed = 0
+        rows = self.db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if self._size <= target:
+                break
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+            removed += 1
+        metrics.count('http_cache.evicted', removed)
+        logging.debug(f'Response cache: {removed} responses evicted')
+
+    @staticmethod
+    def validators(cached):
+        # Headers of conditional request revalidating cached response
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def get_entries(self, link, etag):
+        # Entries of collection stored with etag of its parent entry
+        if not etag:
+            return None
+        cached = self.get(f'{link}#entries')
+        if cached is None or cached['etag'] != etag:
+            record(False)
+            return None
+        record(True, len(cached['data']))
+        return json.loads(cached['data'].decode('utf-8'))
+
+    def set_entries(self, link, etag, entries):
+        if etag:
+            data = json.dumps(entries, separators=(',', ':')).encode('utf-8')
+            self.set(f'{link}#entries', data, etag=etag)
+
+
+def record(hit, size=0):
+    # Hits are responses served from cache, after 304 or without request
+    if hit:
+        metrics.count('http_cache.hits')
+        metrics.count('http_cache.bytes_saved', size)
+    else:
+        metrics.count('http_cache.misses')
+
+
+def httplib2_cache(cache):
+    # Cache used by httplib2 of launchpadlib client instead of files in
+    # cache_dir. httplib2 revalidates stored responses itself, responses are
+    # stored per media type like in MultipleRepresentationCache.
+    from lazr.restfulclient._browser import MultipleRepresentationCache
+
+    class Httplib2Cache(MultipleRepresentationCache):
+        def __init__(self):
+            self.request_media_type = None
+
+        def _key(self, key):
+            if self.request_media_type is not None:
+                key = f'{key}-{self.request_media_type}'
+            return key
+
+        def get(self, key):
+            cached = cache.get(self._key(key))
+            return None if cached is None else cached['data']
+
+        def set(self, key, value):
+            cache.set(self._key(key), value)
+
+        def delete(self, key):
+            cache.delete(self._key(key))
+
+    return Httplib2Cache()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # Shared response cache, None when response_cache_size is 0
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            size = config['launchpad'].getint('response_cache_size')
+            if not size:
+                return None
+            _cache = ResponseCache(config['launchpad']['response_cache'], size * 1024 * 1024)
+        return _cache
@@ -2,7 +2,6 @@
 import logging
 import os
 import json
-import requests
 import dateutil.parser
 import re
 
@@ -10,13 +9,21 @@ from tqdm import tqdm
 
 from bs4 import BeautifulSoup
 
-from lp2jira.attachment import create_attachments
+from lp2jira.attachment import (cancel_attachments, collect_attachments, create_attachments,
+                                downloader)
+from lp2jira.collection import fetcher, iter_collection
 from lp2jira.config import config, lp
 from lp2jira.export import Export
-from lp2jira.user import ExportUser, User
+from lp2jira.history import build_history
+from lp2jira.jira import JiraClient, JiraIndex
+from lp2jira.journal import FAILED, PENDING, Journal
+from lp2jira.mapping import mappings
+from lp2jira.metrics import metrics
+from lp2jira.state import ExportState
+from lp2jira.store import get_store
+from lp2jira.user import ExportUser
 from lp2jira.utils import (bug_id, bug_template, clean_id, convert_custom_field_type,
                            get_custom_fields, get_owner,
-                           get_user_data_from_activity_changed, json_dump,
                            translate_priority, translate_status, translate_blueprint_status)
 
 
@@ -53,18 +60,18 @@ class Issue:
         self.affected_versions = affected_versions
         self.export_user = ExportUser()
 
-    def _export_related_users(self):
+    def _related_users(self):
+        usernames = [clean_id(self.owner)]
         try:
-            username = clean_id(self.owner)
-            if not User.exists(username):
-                self.export_user(username)
+            if self.assignee:
+                usernames.append(clean_id(self.assignee.name))
         except Exception as exc:
             logging.exception(exc)
+        return usernames
+
+    def _export_related_users(self):
         try:
-            if self.assignee:
-                username = clean_id(self.assignee.name)
-                if not User.exists(username):
-                    self.export_user(username)
+            self.export_user.ensure(self._related_users())
         except Exception as exc:
             logging.exception(exc)
 
@@ -75,18 +82,18 @@ class Issue:
             for key, val in get_custom_fields().items():
                 if hasattr(lp_entity, key):
                     lp_val = getattr(lp_entity, key)
-                    val['value'] = convert_custom_field_type(val['fieldType'], lp_val)
-                    customs.append(val)
+                    # Mapping is shared between all issues, never modify it
+                    customs.append(dict(val, value=convert_custom_field_type(val['fieldType'],
+                                                                             lp_val)))
         return customs
 
     @staticmethod
-    def filename(issue_id):
-        name = f'{issue_id.replace("/", "_")}.json'
-        return os.path.normpath(os.path.join(config["local"]["issues"], name))
+    def exists(issue_id):
+        return get_store('issues').exists(issue_id)
 
     @staticmethod
-    def exists(issue_id):
-        return os.path.exists(Issue.filename(issue_id))
+    def remove(issue_id):
+        get_store('issues').remove(issue_id)
 
     def _dump(self):
         issue = {
@@ -118,7 +125,7 @@ class Bug(Issue):
 
         self.updated = updated
         self.comments = comments
-        self.history = history  # TODO: activities
+        self.history = history
         self.fixed_versions = fixed_versions
         self.attachments = attachments
         self.sub_tasks = sub_tasks
@@ -128,7 +135,18 @@ class Bug(Issue):
 
     @classmethod
     def create(cls, task, bug, releases):
-        comments = cls._collect_comments(bug.messages)
+        # Attachments are downloaded in background while the rest is collected
+        attachments = create_attachments(bug)
+        try:
+            return cls._create(task, bug, releases, attachments)
+        except BaseException:
+            cancel_attachments(attachments)
+            raise
+
+    @classmethod
+    def _create(cls, task, bug, releases, attachments):
+        etag = getattr(bug, 'http_etag', None)
+        comments = cls._collect_comments(iter_collection(bug.messages, 'messages', etag))
 
         duplicates = [{'name': 'Duplicate',
                        'sourceId': bug_id(d, task.bug_target_name),
@@ -140,48 +158,11 @@ class Bug(Issue):
         sub_tasks = []
         affected_versions = []
         tags = bug.tags
-        subtask_history = {}
-        history = []
-        for activity in bug.activity:
-            if activity.whatchanged == 'tags':
-                history.append({
-                    'author': clean_id(activity.person_link),
-                    'created': activity.datechanged.isoformat(),
-                    'items': [{
-                        'fieldType': 'jira',
-                        'field': 'labels',
-                        'from': None,
-                        'fromString': activity.oldvalue,
-                        'to': None,
-                        'toString': activity.newvalue
-                    }]
-                })
-
-            if 'assignee' in activity.whatchanged:
-                subtask_target = activity.whatchanged.split(':')[0]
-
-                if not subtask_target in subtask_history:
-                    subtask_history[subtask_target] = []
-
-                old_display, old_name = get_user_data_from_activity_changed(activity.oldvalue)
-                new_display, new_name = get_user_data_from_activity_changed(activity.newvalue)
-
-                subtask_history[subtask_target].append({
-                    'author': clean_id(activity.person_link),
-                    'created': activity.datechanged.isoformat(),
-                    'items': [{
-                        'fieldType': 'jira',
-                        'field': 'assignee',
-                        'from': old_name,
-                        'fromString': old_display,
-                        'to': new_name,
-                        'toString': new_display
-                    }]
-                })
+        history, subtask_history = build_history(iter_collection(bug.activity, 'activity', etag))
 
         links = []
         fixed_versions = []
-        for bug_task in bug.bug_tasks:
+        for bug_task in iter_collection(bug.bug_tasks, 'bug_tasks', etag):
             if bug_task.bug_target_name.startswith(f"{config['launchpad']['project']}/"):
                 version = bug_task.bug_target_name.split('/')[-1]
                 affected_versions.append(version)
@@ -223,18 +204,24 @@ class Bug(Issue):
                    priority=task.importance, tags=tags, created=task.date_created.isoformat(),
                    updated=bug.date_last_updated.isoformat(), comments=comments,
                    history=history + subtask_history.get(config['launchpad']['project'], []),
-                   affected_versions=affected_versions, attachments=create_attachments(bug),
+                   affected_versions=affected_versions, attachments=attachments,
                    sub_tasks=sub_tasks, links=links, releases=releases, duplicates=duplicates,
                    custom_fields=custom_fields, fixed_versions=fixed_versions)
 
     def export(self):
-        self._export_related_users()
-
-        filename = self.filename(self.issue_id)
-        if self.exists(self.issue_id):
-            logging.debug(f'Bug {self.issue_id} already exists, skipping: "{filename}"')
+        try:
+            self._export_related_users()
+            exists = self.exists(self.issue_id)
+        except BaseException:
+            cancel_attachments(self.attachments)
+            raise
+
+        if exists:
+            logging.debug(f'Bug {self.issue_id} already exists, skipping')
+            cancel_attachments(self.attachments)
             return True
 
+        self.attachments = collect_attachments(self.issue_id, self.attachments)
         versions = set(self.fixed_versions + self.affected_versions)
         all_versions = self.releases + convert_versions(versions)
 
@@ -243,8 +230,8 @@ class Bug(Issue):
         export_bug['projects'][0]['issues'] = [self._dump()] + [s._dump() for s in self.sub_tasks]
         export_bug['links'] = self.links + self.duplicates
 
-        with open(filename, 'w') as f:
-            json_dump(export_bug, f)
+        get_store('issues').write(self.issue_id, export_bug, issue_type=self.issue_type,
+                                  updated=self.updated)
 
         logging.debug(f'Bug {self.issue_id} export success')
         return True
@@ -259,23 +246,11 @@ class Bug(Issue):
                       'attachments': self.attachments})
         return issue
 
-    def _export_related_users(self):
-        super()._export_related_users()
-        for comment in self.comments:
-            try:
-                username = clean_id(comment['author'])
-                if not User.exists(username):
-                    self.export_user(username)
-            except Exception as exc:
-                logging.exception(exc)
-
-        for sub_task in self.sub_tasks:
-            try:
-                username = clean_id(sub_task.owner)
-                if not User.exists(username):
-                    self.export_user(username)
-            except Exception as exc:
-                logging.exception(exc)
+    def _related_users(self):
+        usernames = super()._related_users()
+        usernames.extend(clean_id(comment['author']) for comment in self.comments)
+        usernames.extend(clean_id(sub_task.owner) for sub_task in self.sub_tasks)
+        return usernames
 
     @classmethod
     def _collect_comments(cls, messages):
@@ -315,35 +290,115 @@ class ExportBug(Export):
 
 
 class ExportBugs(ExportBug):
-    def run(self):
+    def run(self, workers=1, incremental=False, resume=False, retry_failed=False):
         logging.info('===== Export: Issues =====')
         project = lp.projects[config['launchpad']['project']]
 
-        bug_tasks = project.searchTasks(
-            status=['New', 'Incomplete', 'Opinion', 'Invalid', 'Won\'t Fix', 'Expired',
-                    'Confirmed', 'Triaged', 'In Progress', 'Fix Committed', 'Fix Released',
-                    'Incomplete (with response)', 'Incomplete (without response)'],
-            information_type=['Public', 'Public Security', 'Private Security',
-                              'Private', 'Proprietary', 'Embargoed'],
-            omit_duplicates=False)
+        state = ExportState() if incremental else None
+        started = ExportState.now()
+        journal = Journal(config['journal']['file'])
+        if resume or retry_failed:
+            states = ([PENDING] if resume else []) + ([FAILED] if retry_failed else [])
+            links = journal.load().select(*states)
+            summary = ', '.join(f'{key}: {value}' for key, value in journal.summary().items())
+            logging.info(f'Journal {summary}, issues to export: {len(links)}')
+            journal.reopen()
+            tasks = {}
+        else:
+            tasks = self._search_tasks(project, state)
+            links = {issue_id: task.self_link for issue_id, task in tasks.items()}
+            journal.start(links.items())
 
         releases = get_releases(project)
         failed_issues = []
         counter = 0
 
-        for index, task in enumerate(tqdm(bug_tasks, desc='Export issues')):
-            bug = task.bug 
+        def export_task(issue_id):
+            try:
+                task = tasks.get(issue_id)
+                if task is None or workers > 1:
+                    # Entries loaded in main thread are bound to its connection,
+                    # resumed tasks are loaded by link from journal
+                    task = lp.load(links[issue_id])
+                self._export_task(task, releases, state)
+            except Exception as exc:
+                logging.error(f'Bug export failed for {issue_id}')
+                logging.exception(exc)
+                journal.failed(issue_id, f'{type(exc).__name__}: {exc}')
+                return False
+            journal.done(issue_id)
+            return True
 
-            if super().run(task=task, bug=bug, releases=releases):
+        for index, issue_id, success in self.run_many(export_task, list(links), workers=workers,
+                                                      desc='Export issues', total=len(links)):
+            if success:
                 counter += 1
             else:
-                failed_issues.append(f'index: {index}, id: {bug_id(task)}')
+                failed_issues.append(f'index: {index}, id: {issue_id}')
+        downloader.shutdown()
+        fetcher.shutdown()
+        journal.close()
+
+        if state is not None and not failed_issues and not (resume or retry_failed):
+            # With failures next run starts from the same point
+            state.set_last_run('bugs', started)
 
-        logging.info(f'Exported issues: {counter}/{len(bug_tasks)}')
+        logging.info(f'Exported issues: {counter}/{len(links)}')
         if failed_issues:
             fail_log = '\n'.join(failed_issues)
             logging.info(f'Failed issues:\n{fail_log}')
 
+    def _search_tasks(self, project, state):
+        search = {}
+        if state is not None:
+            modified_since = state.last_run('bugs')
+            if modified_since is not None:
+                logging.info(f'Export issues modified since: {modified_since.isoformat()}')
+                search['modified_since'] = modified_since
+
+        bug_tasks = project.searchTasks(
+            status=['New', 'Incomplete', 'Opinion', 'Invalid', 'Won\'t Fix', 'Expired',
+                    'Confirmed', 'Triaged', 'In Progress', 'Fix Committed', 'Fix Released',
+                    'Incomplete (with response)', 'Incomplete (without response)'],
+            information_type=['Public', 'Public Security', 'Private Security',
+                              'Private', 'Proprietary', 'Embargoed'],
+            omit_duplicates=False, **search)
+
+        tasks = self._group_tasks(iter_collection(bug_tasks, 'searchTasks'))
+        logging.info(f'Tasks found: {len(bug_tasks)}, issues: {len(tasks)}')
+        if state is None:
+            # Existing issues are skipped before their bugs are fetched
+            existing = [issue_id for issue_id in tasks if Issue.exists(issue_id)]
+            for issue_id in existing:
+                del tasks[issue_id]
+            logging.info(f'Issues already exported: {len(existing)}')
+        return tasks
+
+    def _export_task(self, task, releases, state):
+        bug = task.bug
+        if state is None:
+            self.export_entity(task=task, bug=bug, releases=releases)
+            return
+
+        issue_id = bug_id(task)
+        updated = bug.date_last_updated.isoformat()
+        if state.get_bug(issue_id) != updated:
+            Issue.remove(issue_id)
+        self.export_entity(task=task, bug=bug, releases=releases)
+        state.set_bug(issue_id, updated)
+
+    @staticmethod
+    def _group_tasks(tasks):
+        # Tasks of project and of its series belong to the same bug and make
+        # the same issue. Every bug is fetched once, for task of project itself
+        # when there is one.
+        grouped = {}
+        for task in tasks:
+            issue_id = bug_id(task)
+            if issue_id not in grouped or task.bug_target_name == config['launchpad']['project']:
+                grouped[issue_id] = task
+        return grouped
+
 class UpdateBugs:
     def __init__(self):
         self.username = config['jira']['username']
@@ -352,26 +407,38 @@ class UpdateBugs:
         self.json_path = os.path.join(config['local']['export'], config['jira']['issues'])
         self.update_path = os.path.join(config['local']['export'], config['jira']['update'])
 
-        with open(config['mapping']['custom_fields']) as f:
-            mapping = json.load(f)
-            self.id_cf_number = mapping['id']['fieldName'].split('_')[-1]
-
-        with open(self.json_path, 'r') as f:
-            self.lp_issues = json.load(f)['projects'][0]['issues']
+        self.id_cf_field = get_custom_fields()['id']['fieldName']
+        self.id_cf_number = self.id_cf_field.split('_')[-1]
+        self.jira = JiraClient(self.server, self.username, self.password)
+        self.jira_index = None
+        if config['jira'].getboolean('bulk_lookup'):
+            self.jira_index = JiraIndex(self.jira, self.id_cf_field)
+
+        if config['intermediate']['store'] == 'sqlite':
+            # Issues are read from store instead of parsing whole export file
+            store = get_store('issues')
+            self.lp_issues = [issue for _, data in store.load(store.refs()) if data
+                              for issue in data['projects'][0]['issues']]
+        else:
+            with open(self.json_path, 'r') as f:
+                self.lp_issues = json.load(f)['projects'][0]['issues']
 
     def run(self):
-        updated_issues = bug_template()
-
-        for index, lp_issue in enumerate(tqdm(self.lp_issues, desc="Update issues")):
-            external_id = lp_issue['externalId']
+        with metrics.timer('stage.update'):
+            self._update()
 
-            jira_search_result = self.find_lp_issue_in_jira(lp_issue, external_id)
+    def _update(self):
+        updated_issues = bug_template()
+        if self.jira_index is not None:
+            self.jira_index.load()
 
+        results = self.jira.map(self.fetch_jira_issue, self.lp_issues)
+        for lp_issue, (jira_search_result, full_jira_issue) in tqdm(
+                zip(self.lp_issues, results), total=len(self.lp_issues), desc="Update issues"):
             if not jira_search_result['issues']:
                 updated_issues['projects'][0]['issues'].append(lp_issue)
                 continue
 
-            full_jira_issue = self.find_correct_issue(jira_search_result, external_id)
             jira_project = full_jira_issue['projects'][0]
             jira_issue = jira_project['issues'][0]
 
@@ -403,28 +470,33 @@ class UpdateBugs:
         self.export_update(updated_issues)
 
     def verify_update(self):
-        with open(config['mapping']['issue']) as f:
-            status_mapping = json.load(f)
+        status_mapping = mappings.get('issue')
 
         msgs = []
         failed_update = 0
         failed_status = 0
         failed_unexpected = 0
-        for index, lp_issue in enumerate(tqdm(self.lp_issues, desc="Verify")):
+        project = None
+        if self.jira_index is not None:
+            self.jira_index.load()
+        results = self.jira.map(self.try_fetch_jira_issue, self.lp_issues)
+        for lp_issue, (jira_search_result, full_jira_issue, error) in tqdm(
+                zip(self.lp_issues, results), total=len(self.lp_issues), desc="Verify"):
             external_id = lp_issue['externalId']
             try:
-                jira_search_result = self.find_lp_issue_in_jira(lp_issue, external_id)
+                if error is not None:
+                    raise error
                 if not jira_search_result['issues']:
                     msgs.append(f"Launchpad issue with externalID: {external_id} not found in Jira.")
                     failed_update += 1
                 else:
-                    full_jira_issue = self.find_correct_issue(jira_search_result, external_id)
                     lp_status = lp_issue['status']
                     try:
                         translated_lp_status = status_mapping[lp_status]
                     except KeyError:
                         if full_jira_issue['projects'][0]['issues'][0]['issueType'] == "Story":
-                            project = lp.projects[config['launchpad']['project']]
+                            if project is None:
+                                project = lp.projects[config['launchpad']['project']]
                             spec = project.getSpecification(name=external_id)
                             translated_lp_status = translate_blueprint_status(spec)
                         else:
@@ -437,7 +509,7 @@ class UpdateBugs:
                         msgs.append(f"Original Launchpad status: {lp_status}, Jira status: {jira_status}.\n")
             except Exception as exc:
                 msgs.append(f"Exception raised when verify issue with externalID {external_id}.")
-                failed_unexpected += 0
+                failed_unexpected += 1
                 logging.error(f"Exception raised when verify issue with externalID {external_id}.")
                 info = getattr(exc, 'doc', None)
                 if info:
@@ -459,15 +531,35 @@ class UpdateBugs:
         print(log)
         logging.info(f"Verify log:\n{log}")
 
+    def fetch_jira_issue(self, lp_issue):
+        external_id = lp_issue['externalId']
+        with metrics.timer('update.fetch'):
+            jira_search_result = self.find_lp_issue_in_jira(lp_issue, external_id)
+            if not jira_search_result['issues']:
+                return jira_search_result, None
+            return jira_search_result, self.find_correct_issue(jira_search_result, external_id)
+
+    def try_fetch_jira_issue(self, lp_issue):
+        try:
+            return self.fetch_jira_issue(lp_issue) + (None,)
+        except Exception as exc:
+            return None, None, exc
+
     def export_update(self, updated_issues):
         from lp2jira.utils import json_dump
         with open(self.update_path, 'w') as f:
             json_dump(updated_issues, f)
 
+    @staticmethod
+    def lp_timestamp(lp_datetime):
+        return int(dateutil.parser.parse(lp_datetime).timestamp())
+
+    @staticmethod
+    def jira_timestamp(jira_datetime):
+        return int(jira_datetime / 1e3)
+
     def normalize_datetimes(self, lp_datetime, jira_datetime):
-        lp_timestamp = int(dateutil.parser.parse(lp_datetime).timestamp())
-        jira_timestamp = int(jira_datetime / 1e3)
-        return lp_timestamp, jira_timestamp
+        return self.lp_timestamp(lp_datetime), self.jira_timestamp(jira_datetime)
 
     def should_update(self, lp_issue, jira_issue):
         if 'updated' not in lp_issue:
@@ -485,38 +577,30 @@ class UpdateBugs:
                 old.append(i)
 
     def clear_comments(self, lp_comments, jira_comments):
-        cleared_comments = []
-        for comment in lp_comments:
-            if not self.has_comment(jira_comments, comment):
-                cleared_comments.append(comment)
-        return cleared_comments
-
-    def has_comment(self, jira_comments, lp_comment):
+        # Every JIRA comment is normalized once into (body, timestamp) key,
+        # Launchpad comments are matched against set of keys.
+        jira_keys = set()
         for comment in jira_comments:
-            lp_created, jira_created = self.normalize_datetimes(lp_comment['created'],
-                                                                comment['created'])
-            if not 'body' in comment:
-                return True
-            if comment['body'] == lp_comment['body'] and lp_created == jira_created:
-                return True
-        return False
-    
+            if 'body' not in comment:
+                # Comment without body matches every Launchpad comment
+                return []
+            jira_keys.add((comment['body'], self.jira_timestamp(comment['created'])))
+
+        return [comment for comment in lp_comments
+                if (comment['body'], self.lp_timestamp(comment['created'])) not in jira_keys]
+
     def clear_history(self, lp_history, jira_history):
-        cleared_history = []
-        for record in lp_history:
-            if not self.has_record(jira_history, record):
-                cleared_history.append(record)
-        return cleared_history
-
-    def has_record(self, jira_history, lp_record):
-        for record in jira_history:
-            lp_created, jira_created = self.normalize_datetimes(lp_record['created'],
-                                                                record['created'])
-            if record['author'] == lp_record['author'] and lp_created == jira_created:
-                return True
-        return False
+        jira_keys = {(record['author'], self.jira_timestamp(record['created']))
+                     for record in jira_history}
+        return [record for record in lp_history
+                if (record['author'], self.lp_timestamp(record['created'])) not in jira_keys]
 
     def find_lp_issue_in_jira(self, lp_issue, external_id):
+        if self.jira_index is not None:
+            issue_key = self.jira_index.get(external_id)
+            if issue_key is not None:
+                return {'issues': [{'key': issue_key, 'fields': {self.id_cf_field: external_id}}]}
+
         is_blueprint = lp_issue["issueType"] == "Story"
         if is_blueprint or "/" not in external_id:
             cf_id = external_id
@@ -525,7 +609,10 @@ class UpdateBugs:
         return self.search_jira_for_issue(cf_id, is_blueprint)
 
     def find_correct_issue(self, jira_search_result, externalId):
-        for issue in jira_search_result['issues']:
+        # Search results carry ID field, issues with exact ID are checked first
+        issues = sorted(jira_search_result['issues'],
+                        key=lambda i: i.get('fields', {}).get(self.id_cf_field) != externalId)
+        for issue in issues:
             full_jira_issue = self.get_full_jira_issue(issue['key'])
             for custom_field in full_jira_issue['projects'][0]['issues'][0]['customFieldValues']:
                     if custom_field['value'] == externalId:
@@ -533,11 +620,10 @@ class UpdateBugs:
 
     def search_jira_for_issue(self, external_id, is_blueprint):
         if is_blueprint:
-            url = f'{self.server}/rest/api/2/search?jql=text~{external_id}'
+            jql = f'text~{external_id}'
         else:
-            url = f'{self.server}/rest/api/2/search?jql=cf[{self.id_cf_number}]~{external_id}'
-        return requests.get(url, auth=(self.username, self.password)).json()
-    
+            jql = f'cf[{self.id_cf_number}]~{external_id}'
+        return self.jira.search(jql, fields=[self.id_cf_field])
+
     def get_full_jira_issue(self, issue_key):
-        url = f'{self.server}/si/com.atlassian.jira.plugins.jira-importers-plugin:issue-json/{issue_key}/{issue_key}.json'
-        return requests.get(url, auth=(self.username, self.password)).json()
+        return self.jira.get_issue_json(issue_key)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import collections
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from lp2jira.config import config
+from lp2jira.metrics import metrics
+
+
+class JiraClient:
+    # One keep-alive session shared by all worker threads.
+    # Rate limited and failed requests are retried with exponential backoff.
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, server=None, username=None, password=None):
+        self.server = (server or config['jira']['server']).rstrip('/')
+        self.workers = config['jira'].getint('workers')
+        self.timeout = config['jira'].getfloat('timeout')
+
+        retry = Retry(total=config['jira'].getint('retries'),
+                      backoff_factor=config['jira'].getfloat('backoff'),
+                      status_forcelist=self.retry_statuses)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.auth = (username or config['jira']['username'],
+                             password or config['jira']['password'])
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, path, params=None, endpoint=None):
+        started = time.monotonic()
+        response = self.session.get(f'{self.server}{path}', params=params, timeout=self.timeout)
+        metrics.request('jira', endpoint or path, time.monotonic() - started,
+                        len(response.content), response.status_code)
+        return response.json()
+
+    def search(self, jql, fields=None, start_at=0, max_results=None):
+        params = {'jql': jql}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if start_at:
+            params['startAt'] = start_at
+        if max_results:
+            params['maxResults'] = max_results
+        return self.get('/rest/api/2/search', params=params, endpoint='search')
+
+    def get_issue_json(self, issue_key):
+        return self.get(f'/si/com.atlassian.jira.plugins.jira-importers-plugin:issue-json/'
+                        f'{issue_key}/{issue_key}.json', endpoint='issue-json')
+
+    def map(self, func, items):
+        # Like Executor.map, but only a few items per worker are in flight,
+        # results are yielded in order of items.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+class JiraIndex:
+    # Maps externalId of every issue in JIRA project to its issue key.
+    # Whole project is paged through once instead of one search per issue,
+    # index is saved to disk and reused until it's older than max_age.
+    def __init__(self, client, field):
+        self.client = client
+        self.field = field
+        self.filename = config['jira']['index']
+        self.max_age = config['jira'].getint('index_max_age')
+        self.page_size = config['jira'].getint('page_size')
+        self.keys = None
+
+    def get(self, external_id):
+        if self.keys is None:
+            self.load()
+        return self.keys.get(external_id)
+
+    def load(self):
+        if (os.path.exists(self.filename)
+                and time.time() - os.path.getmtime(self.filename) < self.max_age):
+            with open(self.filename, 'r') as f:
+                self.keys = json.load(f)
+            logging.info(f'JIRA index loaded: {len(self.keys)} issues')
+            return
+
+        self.build()
+        with open(self.filename, 'w') as f:
+            json.dump(self.keys, f)
+
+    def build(self):
+        jql = f'project = "{config["jira"]["key"]}" ORDER BY key'
+        first_page = self._page(jql, 0)
+        # Server may cap maxResults below page_size, pages step by size it returned
+        step = first_page.get('maxResults') or len(first_page['issues']) or self.page_size
+        starts = range(len(first_page['issues']), first_page.get('total', 0), step)
+        pages = self.client.map(lambda start: self._page(jql, start), starts)
+
+        self.keys = {}
+        for page in [first_page, *pages]:
+            for issue in page['issues']:
+                external_id = issue.get('fields', {}).get(self.field)
+                if external_id:
+                    self.keys[external_id] = issue['key']
+        logging.info(f'JIRA index built: {len(self.keys)} issues')
+
+    def _page(self, jql, start):
+        return self.client.search(jql, fields=[self.field], start_at=start,
+                                  max_results=self.page_size)
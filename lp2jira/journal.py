@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal:
+    # Append-only log of issues export. Every issue is written as pending
+    # before export starts, and as done or failed (with reason) as soon as
+    # its export finishes. Last record of issue is its state, so run stopped
+    # at any point can be resumed from pending issues, without searching
+    # Launchpad again, and failed issues can be retried.
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._file = None
+        self.entries = {}
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.filename):
+            return self
+        with open(self.filename, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line can be cut by interrupted run
+                    continue
+                self.entries[record['id']] = record
+        return self
+
+    def start(self, tasks):
+        # New journal with every task pending, tasks are pairs (issue_id, link)
+        self.close()
+        self.entries = {}
+        self._file = open(self.filename, 'w')
+        self._write(self._record(issue_id, link, PENDING) for issue_id, link in tasks)
+        return self
+
+    def reopen(self):
+        self.close()
+        self._file = open(self.filename, 'a')
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def done(self, issue_id):
+        self._write([self._record(issue_id, self.entries[issue_id]['link'], DONE)])
+
+    def failed(self, issue_id, reason):
+        self._write([self._record(issue_id, self.entries[issue_id]['link'], FAILED, reason)])
+
+    def select(self, *states):
+        return {issue_id: record['link'] for issue_id, record in self.entries.items()
+                if record['state'] in states}
+
+    def summary(self):
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        for record in self.entries.values():
+            counts[record['state']] += 1
+        return counts
+
+    @staticmethod
+    def _record(issue_id, link, state, reason=None):
+        record = {'id': issue_id, 'link': link, 'state': state}
+        if reason is not None:
+            record['reason'] = reason
+        return record
+
+    def _write(self, records):
+        with self._lock:
+            for record in records:
+                self.entries[record['id']] = record
+                self._file.write(json.dumps(record) + '\n')
+            # Flushed after every change, so it survives crash of the process
+            self._file.flush()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+
+from lp2jira.config import config
+
+
+def compile_blueprint_rules(mapping):
+    return [(BlueprintRule(m['conditions']), m['status']) for m in mapping]
+
+
+class BlueprintRule:
+    def __init__(self, conditions):
+        self.conditions = [(condition, value.lower() if isinstance(value, str) else value)
+                           for condition, value in conditions.items()]
+
+    @property
+    def fields(self):
+        return [condition for condition, _ in self.conditions]
+
+    def __call__(self, spec):
+        for condition, value in self.conditions:
+            try:
+                spec_v = getattr(spec, condition)
+            except AttributeError as exc:
+                logging.error(f'Blueprint does not have attribute: "{condition}"')
+                logging.exception(exc)
+                continue
+
+            if isinstance(spec_v, str):
+                spec_v = spec_v.lower()
+            if spec_v != value:
+                return False
+        return True
+
+
+class MappingRegistry:
+    # Seconds between checks if mapping file has been modified
+    check_interval = 1.0
+
+    compilers = {
+        'blueprint': compile_blueprint_rules,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def get(self, name):
+        now = time.monotonic()
+        table = self._tables.get(name)
+        if table is not None and now - table['checked'] < self.check_interval:
+            return table['data']
+
+        with self._lock:
+            filename = config['mapping'][name]
+            mtime = os.stat(filename).st_mtime
+            table = self._tables.get(name)
+            if table is None or table['mtime'] != mtime:
+                with open(filename, 'r') as f:
+                    data = json.load(f)
+                compiler = self.compilers.get(name)
+                if compiler is not None:
+                    data = compiler(data)
+                logging.debug(f'Mapping "{name}" loaded from: "{filename}"')
+            else:
+                data = table['data']
+            # Tables are read without lock, only complete ones are published
+            self._tables[name] = {'mtime': mtime, 'data': data, 'checked': now}
+            return data
+
+    def lookup(self, name, key, default=None):
+        return self.get(name).get(key, default)
+
+
+mappings = MappingRegistry()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+from lp2jira.config import config
+
+# Upper bounds of histogram buckets in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def endpoint_name(url):
+    # Ids and names in path are replaced with "*", so requests of the same
+    # kind are counted together: /devel/bugs/*/messages
+    parts = urlsplit(str(url))
+    path = re.sub(r'/~[^/]+', '/~*', parts.path)
+    path = re.sub(r'(/\+[^/]+)/[^/]+', r'\1/*', path)
+    path = re.sub(r'/\d+(?=/|$)', '/*', path)
+    operation = parse_qs(parts.query).get('ws.op')
+    if operation:
+        path = f'{path}?ws.op={operation[0]}'
+    return path
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def report(self):
+        buckets = {f'le_{bound}': count for bound, count in zip(BUCKETS, self.buckets)}
+        buckets['inf'] = self.buckets[-1]
+        return {'count': self.count,
+                'total': round(self.total, 6),
+                'mean': round(self.total / self.count, 6) if self.count else 0,
+                'min': round(self.min or 0, 6),
+                'max': round(self.max, 6),
+                'buckets': buckets}
+
+
+class Metrics:
+    # Counters and timings of Launchpad and JIRA requests and of export stages.
+    # Shared by all threads, saved as JSON report at the end of export and,
+    # when interval is set, periodically during export.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self._reporter = None
+        self._stop = threading.Event()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def request(self, service, endpoint, seconds, size=0, status=None):
+        name = f'{service}.{endpoint}'
+        with self._lock:
+            self.histograms[name].observe(seconds)
+            self.counters[f'{name}.bytes'] += size
+            self.counters[f'{service}.requests'] += 1
+            self.counters[f'{service}.bytes'] += size
+            if status is not None:
+                self.counters[f'{service}.status.{status}'] += 1
+
+    def report(self):
+        with self._lock:
+            return {'elapsed': round(time.time() - self.started, 3),
+                    'counters': dict(sorted(self.counters.items())),
+                    'timings': {name: histogram.report()
+                                for name, histogram in sorted(self.histograms.items())}}
+
+    def dump(self, filename=None):
+        # utils imports metrics, so atomic_write is imported on use
+        from lp2jira.utils import atomic_write
+        filename = filename or config['metrics']['report']
+        with atomic_write(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return filename
+
+    def start_reporting(self, interval):
+        if interval <= 0 or self._reporter is not None:
+            return
+        self._stop.clear()
+        self._reporter = threading.Thread(target=self._report_every, args=(interval,),
+                                          name='metrics', daemon=True)
+        self._reporter.start()
+
+    def stop_reporting(self):
+        if self._reporter is not None:
+            self._stop.set()
+            self._reporter.join()
+            self._reporter = None
+
+    def _report_every(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.dump()
+            except OSError as exc:
+                logging.warning(f'Metrics report not saved: {exc}')
+
+
+metrics = Metrics()
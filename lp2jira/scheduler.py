@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from contextlib import contextmanager
+
+from lp2jira.metrics import metrics
+
+
+class Budget:
+    # Number of export jobs running at once in all stages together.
+    # Without size jobs are limited only by workers of every stage.
+    def __init__(self):
+        self._semaphore = None
+
+    def set(self, size):
+        self._semaphore = threading.BoundedSemaphore(size) if size else None
+
+    @contextmanager
+    def slot(self):
+        semaphore = self._semaphore
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+
+class StageScheduler:
+    # Runs export stages in threads. Stage starts as soon as all stages it
+    # depends on are done, independent stages run at the same time.
+    # Stages depending on a failed stage are skipped, first error is raised
+    # when all stages end.
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, func, after=()):
+        self.stages.append((name, func, tuple(after)))
+        return name
+
+    def run(self):
+        done = {name: threading.Event() for name, _, _ in self.stages}
+        errors = {}
+
+        def run_stage(name, func, after):
+            try:
+                for dependency in after:
+                    done[dependency].wait()
+                failed = [dependency for dependency in after if dependency in errors]
+                if failed:
+                    logging.error(f'Stage {name} skipped, failed stages: {", ".join(failed)}')
+                    errors[name] = None
+                    return
+                with metrics.timer(f'stage.{name}.total'):
+                    func()
+            except Exception as exc:
+                logging.error(f'Stage {name} failed')
+                logging.exception(exc)
+                errors[name] = exc
+            finally:
+                done[name].set()
+
+        # Daemon threads don't keep process alive when run is interrupted
+        threads = [threading.Thread(target=run_stage, args=stage, name=f'stage-{stage[0]}',
+                                    daemon=True)
+                   for stage in self.stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for name, _, _ in self.stages:
+            if errors.get(name) is not None:
+                raise errors[name]
+
+
+budget = Budget()
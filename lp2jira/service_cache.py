@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from lp2jira import http_cache
+from lp2jira.config import config
+from lp2jira.metrics import endpoint_name, metrics
+from lp2jira.utils import atomic_write
+
+# Every Launchpad login fetches WADL description and service root of API.
+# Both are stored in cache_dir and reused until they are older than
+# service_cache_max_age, so login makes no requests at all.
+
+
+class ServiceDescriptionCache:
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _filename(self, kind, url):
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, f'service_{kind}_{digest}')
+
+    def get(self, kind, url):
+        filename = self._filename(kind, url)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.max_age:
+                return None
+            with open(filename, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, kind, url, content):
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_write(self._filename(kind, url), 'wb') as f:
+            f.write(content)
+
+
+_install_lock = threading.Lock()
+
+
+def install():
+    # ServiceRoot creates its Browser from lazr.restfulclient.resource module,
+    # browser with cache is put there before first login.
+    from lazr.restfulclient import resource
+    from lazr.restfulclient._browser import Browser
+    from lazr.restfulclient.errors import HTTPError
+    from wadllib.application import Application
+    from lazr.uri import URI
+
+    with _install_lock:
+        if getattr(resource.Browser, 'service_cache', None) is not None:
+            return
+
+        cache = ServiceDescriptionCache(config['launchpad']['cache_dir'],
+                                        config['launchpad'].getint('service_cache_max_age'))
+
+        class CachingBrowser(Browser):
+            service_cache = cache
+            wadl_type = 'application/vnd.sun.wadl+xml'
+            no_store = {'Cache-Control': 'no-store'}
+
+            def __init__(self, service_root, credentials, cache=None, *args, **kwargs):
+                self.response_cache = http_cache.get_cache()
+                if self.response_cache is not None:
+                    cache = http_cache.httplib2_cache(self.response_cache)
+                super().__init__(service_root, credentials, cache, *args, **kwargs)
+                self._service_root = str(service_root._root_uri)
+
+            def get_wadl_application(self, url):
+                url = str(url)
+                content = self.service_cache.get('wadl', url)
+                if content is None:
+                    logging.debug(f'Fetching service description: {url}')
+                    response, content = self._request(url, media_type=self.wadl_type)
+                    if not isinstance(content, bytes):
+                        content = content.encode('utf-8')
+                    self.service_cache.set('wadl', url, content)
+                return Application(url, content)
+
+            # Every Launchpad request is counted in metrics by its endpoint,
+            # GET answered from response cache also as cache hit
+            def _request(self, url, data=None, method='GET', *args, **kwargs):
+                started = time.monotonic()
+                status = 'error'
+                size = 0
+                try:
+                    response, content = super()._request(url, data, method, *args, **kwargs)
+                    status = response.status
+                    size = len(content) if isinstance(content, (bytes, str)) else 0
+                    if (self.response_cache is not None and method == 'GET'
+                            and 'Cache-Control' not in (kwargs.get('extra_headers') or {})):
+                        fromcache = getattr(response, 'fromcache', False)
+                        http_cache.record(fromcache, size)
+                        if fromcache:
+                            size = 0
+                    return response, content
+                except HTTPError as exc:
+                    status = exc.response.status
+                    raise
+                finally:
+                    metrics.request('launchpad', endpoint_name(url),
+                                    time.monotonic() - started, size, status)
+
+            def get(self, resource_or_uri, headers=None, return_response=False):
+                if isinstance(resource_or_uri, (str, URI)):
+                    url = str(resource_or_uri)
+                else:
+                    url = str(resource_or_uri.get_method('get').build_request_url())
+                if self.response_cache is not None and url.endswith('/data'):
+                    # Hosted files like attachment data are not kept in response
+                    # cache, attachments manifest already skips downloaded files
+                    headers = dict(headers or {}, **self.no_store)
+                if headers is not None or return_response or url != self._service_root:
+                    return super().get(resource_or_uri, headers, return_response)
+
+                content = self.service_cache.get('root', url)
+                if content is None:
+                    content = super().get(resource_or_uri)
+                    self.service_cache.set('root', url, content)
+                return content
+
+        resource.Browser = CachingBrowser
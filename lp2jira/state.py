@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import datetime
+import sqlite3
+import threading
+
+import dateutil.parser
+
+from lp2jira.config import config
+
+
+class ExportState:
+    # Remembers what has been exported in previous runs: last update date of
+    # every bug, fingerprint of every blueprint and start time of every run.
+    def __init__(self, filename=None):
+        self.filename = filename or config['incremental']['database']
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS bugs '
+                             '(issue_id TEXT PRIMARY KEY, updated TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS specs '
+                             '(name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS runs '
+                             '(name TEXT PRIMARY KEY, started TEXT NOT NULL)')
+        return self._db
+
+    def _get(self, query, key):
+        with self._lock:
+            row = self.db.execute(query, (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, query, key, value):
+        with self._lock:
+            self.db.execute(query, (key, value))
+
+    def get_bug(self, issue_id):
+        return self._get('SELECT updated FROM bugs WHERE issue_id = ?', issue_id)
+
+    def set_bug(self, issue_id, updated):
+        self._set('INSERT OR REPLACE INTO bugs (issue_id, updated) VALUES (?, ?)',
+                  issue_id, updated)
+
+    def get_spec(self, name):
+        return self._get('SELECT fingerprint FROM specs WHERE name = ?', name)
+
+    def set_spec(self, name, fingerprint):
+        self._set('INSERT OR REPLACE INTO specs (name, fingerprint) VALUES (?, ?)',
+                  name, fingerprint)
+
+    def last_run(self, name):
+        started = self._get('SELECT started FROM runs WHERE name = ?', name)
+        return dateutil.parser.parse(started) if started else None
+
+    def set_last_run(self, name, started):
+        self._set('INSERT OR REPLACE INTO runs (name, started) VALUES (?, ?)',
+                  name, started.isoformat())
+
+    @staticmethod
+    def now():
+        return datetime.datetime.now(datetime.timezone.utc)
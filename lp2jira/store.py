@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import itertools
+import json
+import os
+import sqlite3
+import threading
+
+from lp2jira.config import config
+from lp2jira.metrics import metrics
+from lp2jira.utils import json_dump_file
+
+
+class FileStore:
+    # One JSON file per issue or user in directory from [local] section.
+    # References of stored items are file names.
+    def __init__(self, kind):
+        self.kind = kind
+        self.directory = config['local'][kind]
+
+    def filename(self, key):
+        name = f'{key.replace("/", "_")}.json'
+        return os.path.normpath(os.path.join(self.directory, name))
+
+    def exists(self, key):
+        return os.path.exists(self.filename(key))
+
+    def write(self, key, data, issue_type=None, updated=None):
+        json_dump_file(data, self.filename(key))
+
+    def remove(self, key):
+        try:
+            os.remove(self.filename(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        return [os.path.splitext(ref)[0] for ref in self.refs()]
+
+    def refs(self):
+        return sorted(filename for filename in os.listdir(self.directory)
+                      if filename.endswith('.json'))
+
+    def load(self, refs):
+        # Yields (ref, data), data is None when file can't be parsed
+        for ref in refs:
+            with open(os.path.join(self.directory, ref), 'r') as f:
+                try:
+                    yield ref, json.load(f)
+                except ValueError:
+                    yield ref, None
+
+
+class SqliteStore:
+    # All issues and users in one SQLite database, keyed by externalId
+    # or username. Existence checks and reads are indexed queries, WAL lets
+    # compile processes read while export writes. References are keys.
+    def __init__(self, kind, filename=None):
+        self.kind = kind
+        self.filename = filename or config['intermediate']['database']
+        self._lock = threading.Lock()
+        self._db = None
+
+    def __getstate__(self):
+        # Store is sent to compile processes, every process connects itself
+        return {'kind': self.kind, 'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['kind'], state['filename'])
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entities '
+                             '(kind TEXT NOT NULL, key TEXT NOT NULL, type TEXT, updated TEXT, '
+                             'data TEXT NOT NULL, PRIMARY KEY (kind, key))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entities_type '
+                             'ON entities (kind, type)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entities_updated '
+                             'ON entities (kind, updated)')
+        return self._db
+
+    def exists(self, key):
+        with self._lock:
+            row = self.db.execute('SELECT 1 FROM entities WHERE kind = ? AND key = ?',
+                                  (self.kind, key)).fetchone()
+        return row is not None
+
+    def write(self, key, data, issue_type=None, updated=None):
+        with metrics.timer('json_dump'):
+            text = json.dumps(data, separators=(',', ':'))
+        with self._lock:
+            self.db.execute('INSERT OR REPLACE INTO entities (kind, key, type, updated, data) '
+                            'VALUES (?, ?, ?, ?, ?)', (self.kind, key, issue_type, updated, text))
+
+    def remove(self, key):
+        with self._lock:
+            self.db.execute('DELETE FROM entities WHERE kind = ? AND key = ?', (self.kind, key))
+
+    def keys(self):
+        with self._lock:
+            rows = self.db.execute('SELECT key FROM entities WHERE kind = ? ORDER BY key',
+                                   (self.kind,)).fetchall()
+        return [row[0] for row in rows]
+
+    def refs(self):
+        return self.keys()
+
+    def load(self, refs, batch_size=500):
+        refs = iter(refs)
+        while True:
+            batch = list(itertools.islice(refs, batch_size))
+            if not batch:
+                break
+            query = (f'SELECT key, data FROM entities WHERE kind = ? '
+                     f'AND key IN ({", ".join("?" * len(batch))})')
+            with self._lock:
+                rows = dict(self.db.execute(query, [self.kind] + batch).fetchall())
+            for ref in batch:
+                try:
+                    yield ref, json.loads(rows[ref])
+                except (KeyError, ValueError):
+                    yield ref, None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(kind):
+    # Store of 'issues' or 'users', selected by [intermediate] store
+    with _stores_lock:
+        if kind not in _stores:
+            if config['intermediate']['store'] == 'sqlite':
+                _stores[kind] = SqliteStore(kind)
+            else:
+                _stores[kind] = FileStore(kind)
+        return _stores[kind]
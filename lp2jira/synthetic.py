@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import random
+
+from lp2jira.fixture import SERVICE_ROOT
+
+STATUSES = ['New', 'Incomplete', 'Opinion', 'Invalid', 'Won\'t Fix', 'Expired', 'Confirmed',
+            'Triaged', 'In Progress', 'Fix Committed', 'Fix Released']
+IMPORTANCES = ['Critical', 'High', 'Medium', 'Low', 'Wishlist', 'Undecided']
+IMPLEMENTATION = ['Unknown', 'Not started', 'Started', 'Slow progress', 'Good progress',
+                  'Beta Available', 'Needs Code Review', 'Deferred', 'Implemented']
+
+
+class SyntheticProject:
+    # Generates project of given size in fixture backend format,
+    # same seed always gives the same project.
+    def __init__(self, directory, project='synthetic', bugs=100, sub_tasks=2, comments=10,
+                 activity=20, attachments=1, users=50, specifications=10, releases=10, seed=0):
+        self.directory = directory
+        self.project = project
+        self.bugs = bugs
+        self.sub_tasks = sub_tasks
+        self.comments = comments
+        self.activity = activity
+        self.attachments = attachments
+        self.users = users
+        self.specifications = specifications
+        self.releases = releases
+        self.random = random.Random(seed)
+        self.start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def generate(self):
+        for path in ('projects', 'bugs', 'people', 'files'):
+            os.makedirs(os.path.join(self.directory, path), exist_ok=True)
+
+        usernames = [f'user{i}' for i in range(self.users)]
+        for username in usernames:
+            self._write(('people', f'{username}.json'), self._person(username))
+
+        versions = [f'r{i // 10}.{i % 10}' for i in range(1, self.releases + 1)]
+        tasks = []
+        for bug_id in range(1, self.bugs + 1):
+            bug = self._bug(bug_id, usernames, versions)
+            self._write(('bugs', f'{bug_id}.json'), bug)
+            tasks.extend(t for t in bug['bug_tasks']
+                         if t['bug_target_name'].split('/')[0] == self.project)
+
+        project = {
+            'resource_type': 'project',
+            'self_link': f'{SERVICE_ROOT}{self.project}',
+            'name': self.project,
+            'releases': [{'version': v, 'date_released': self._date(i * 30)}
+                         for i, v in enumerate(versions)],
+            'milestones': [{'self_link': f'{SERVICE_ROOT}{self.project}/+milestone/{v}', 'name': v}
+                           for v in versions],
+            'subscriptions': [{'subscriber_link': self._person_link(u)} for u in usernames[:10]],
+            'specifications': [self._spec(i, usernames) for i in range(self.specifications)],
+            'tasks': tasks,
+        }
+        self._write(('projects', f'{self.project}.json'), project)
+
+    def _write(self, path, data):
+        with open(os.path.join(self.directory, *path), 'w') as f:
+            json.dump(data, f)
+
+    def _date(self, days):
+        return (self.start + datetime.timedelta(days=days, seconds=self.random.randint(0, 86399))
+                ).isoformat()
+
+    @staticmethod
+    def _person_link(username):
+        return f'{SERVICE_ROOT}~{username}'
+
+    def _person(self, username):
+        hidden = self.random.random() < 0.3
+        return {
+            'self_link': self._person_link(username),
+            'name': username,
+            'display_name': f'Synthetic {username.title()}',
+            'hide_email_addresses': hidden,
+            'preferred_email_address': None if hidden else {'email': f'{username}@example.com'},
+        }
+
+    def _text(self, words):
+        return ' '.join(self.random.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'vrouter',
+                                            'agent', 'control', 'crash', 'config'])
+                        for _ in range(words))
+
+    def _bug(self, bug_id, usernames, versions):
+        bug_link = f'{SERVICE_ROOT}bugs/{bug_id}'
+        created = self.random.randint(0, 1000)
+        updated = self._date(created + 100)
+
+        messages = [{
+            'self_link': f'{bug_link}/comments/{n}',
+            'content': self._text(40),
+            'date_created': self._date(created + n),
+            'owner_link': self._person_link(self.random.choice(usernames)),
+            'http_etag': f'"{bug_id:x}{n:x}-{self.random.getrandbits(32):x}"',
+        } for n in range(self.comments)]
+
+        targets = [self.project] + self.random.sample(
+            [f'{self.project}/{v}' for v in versions], min(self.sub_tasks, len(versions)))
+        bug_tasks = [self._task(bug_id, target, usernames, versions, created, updated)
+                     for target in targets]
+
+        activity = []
+        for n in range(self.activity):
+            field = self.random.choice(['tags', 'summary', 'status', 'importance',
+                                        'assignee', 'milestone'])
+            old, new = self._change(field, usernames, versions)
+            activity.append({
+                'whatchanged': field if field in ('tags', 'summary')
+                else f'{self.random.choice(targets)}: {field}',
+                'oldvalue': old,
+                'newvalue': new,
+                'person_link': self._person_link(self.random.choice(usernames)),
+                'datechanged': self._date(created + n),
+            })
+
+        attachments = [{
+            'resource_type': 'bug_attachment',
+            'self_link': f'{bug_link}/+attachment/{bug_id * 100 + n}',
+            'data_file': f'{bug_id}/log_{n}.txt',
+            'message_link': messages[0]['self_link'] if messages else None,
+        } for n in range(self.attachments)]
+        if attachments:
+            os.makedirs(os.path.join(self.directory, 'files', str(bug_id)), exist_ok=True)
+        for attachment in attachments:
+            with open(os.path.join(self.directory, 'files', attachment['data_file']), 'w') as f:
+                f.write(self._text(200))
+
+        return {
+            'self_link': bug_link,
+            'id': bug_id,
+            'title': self._text(6),
+            'description': self._text(80),
+            'tags': self.random.sample(['ui', 'vrouter', 'agent', 'config', 'analytics'], 2),
+            'owner_link': self._person_link(self.random.choice(usernames)),
+            'date_last_updated': updated,
+            'messages': messages,
+            'activity': activity,
+            'attachments': attachments,
+            'bug_tasks': bug_tasks,
+            'duplicates': [],
+        }
+
+    def _change(self, field, usernames, versions):
+        if field == 'tags':
+            return ' '.join(self.random.sample(['ui', 'vrouter', 'agent'], 2)), 'ui'
+        if field == 'summary':
+            return self._text(6), self._text(6)
+        if field == 'status':
+            return tuple(self.random.sample(STATUSES, 2))
+        if field == 'importance':
+            return tuple(self.random.sample(IMPORTANCES, 2))
+        if field == 'milestone':
+            return self.random.choice(versions + [None]), self.random.choice(versions)
+        old, new = self.random.sample(usernames, 2)
+        return f'Synthetic {old.title()} ({old})', f'Synthetic {new.title()} ({new})'
+
+    def _task(self, bug_id, target, usernames, versions, created, updated):
+        milestone = self.random.choice(versions + [None])
+        assignee = self.random.choice(usernames + [None])
+        return {
+            'self_link': f'{SERVICE_ROOT}{target}/+bug/{bug_id}',
+            'bug_link': f'{SERVICE_ROOT}bugs/{bug_id}',
+            'bug_target_name': target,
+            'title': f'Bug #{bug_id} in {target}',
+            'status': self.random.choice(STATUSES),
+            'importance': self.random.choice(IMPORTANCES),
+            'owner_link': self._person_link(self.random.choice(usernames)),
+            'assignee_link': self._person_link(assignee) if assignee else None,
+            'milestone_link': (f'{SERVICE_ROOT}{self.project}/+milestone/{milestone}'
+                               if milestone else None),
+            'date_created': self._date(created),
+            'date_last_updated': updated,
+        }
+
+    def _spec(self, index, usernames):
+        name = f'spec-{index}'
+        assignee = self.random.choice(usernames + [None])
+        return {
+            'self_link': f'{SERVICE_ROOT}{self.project}/+spec/{name}',
+            'name': name,
+            'title': self._text(5),
+            'summary': self._text(30),
+            'whiteboard': self._text(20),
+            'workitems_text': self._text(10),
+            'owner_link': self._person_link(self.random.choice(usernames)),
+            'assignee_link': self._person_link(assignee) if assignee else None,
+            'priority': self.random.choice(IMPORTANCES),
+            'date_created': self._date(index),
+            'is_started': self.random.random() < 0.5,
+            'is_complete': self.random.random() < 0.2,
+            'implementation_status': self.random.choice(IMPLEMENTATION),
+            'definition_status': 'Approved',
+        }
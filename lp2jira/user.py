@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 import logging
-import os
+import threading
 
 from tqdm import tqdm
 
 from lp2jira.config import config, lp
 from lp2jira.export import Export
-from lp2jira.utils import clean_id, get_user_groups, json_dump, generate_mail
+from lp2jira.store import get_store
+from lp2jira.utils import clean_id, get_user_groups, generate_mail
 
 
 class User:
@@ -39,22 +40,16 @@ class User:
                     email=email, user_groups=get_user_groups())
             
 
-    @staticmethod
-    def filename(username):
-        return os.path.normpath(os.path.join(config["local"]["users"], f'{username}.json'))
-
     @staticmethod
     def exists(username):
-        return os.path.exists(User.filename(username))
+        return get_store('users').exists(username)
 
     def export(self):
-        filename = self.filename(self.name)
-        if self.exists(filename):
-            logging.debug(f'User {self.display_name} already exists, skipping: "{filename}"')
+        if self.exists(self.name):
+            logging.debug(f'User {self.display_name} already exists, skipping')
             return True
 
-        with open(filename, 'w') as f:
-            json_dump(self._dump(), f)
+        get_store('users').write(self.name, self._dump())
 
         logging.debug(f'User User {self.display_name} export success')
         return True
@@ -73,12 +68,83 @@ class User:
         return dmp
 
 
+class UserIndex:
+    # Remembers every username seen during run, so each Launchpad person
+    # is fetched at most once. Known users are seeded from users directory.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resolved = threading.Condition(self._lock)
+        self.known = None
+        self.exported = set()
+        self.failed = set()
+        self.pending = set()
+
+    def _seed(self):
+        if self.known is None:
+            self.known = set(get_store('users').keys())
+
+    def is_known(self, username):
+        with self._lock:
+            self._seed()
+            return username in self.known
+
+    def claim(self, usernames):
+        # Returns usernames which are neither exported nor failed
+        # nor being exported by other thread at the moment.
+        with self._lock:
+            self._seed()
+            new = []
+            for username in usernames:
+                if (username in self.known or username in self.failed
+                        or username in self.pending):
+                    continue
+                self.pending.add(username)
+                new.append(username)
+            return new
+
+    def resolve(self, username, success):
+        with self._lock:
+            self.pending.discard(username)
+            if success:
+                self.known.add(username)
+                self.exported.add(username)
+            else:
+                self.failed.add(username)
+            self._resolved.notify_all()
+
+    def wait(self, usernames):
+        # Blocks until none of usernames is being exported by other thread
+        with self._lock:
+            self._resolved.wait_for(lambda: self.pending.isdisjoint(usernames))
+
+    def ensure(self, usernames, export_user):
+        claimed = self.claim(usernames)
+        resolved = 0
+        try:
+            for username in claimed:
+                self.resolve(username, export_user(username))
+                resolved += 1
+        finally:
+            # Interrupted export leaves no user pending for other threads
+            for username in claimed[resolved:]:
+                self.resolve(username, False)
+
+
+user_index = UserIndex()
+
+
 class ExportUser(Export):
     def __init__(self):
         super().__init__(entity=User)
 
+    def ensure(self, usernames):
+        user_index.ensure(usernames, self.run)
+
+
+class ExportSubscribers:
+    def __init__(self):
+        self.export_user = ExportUser()
 
-class ExportSubscribers(ExportUser):
     def run(self):
         logging.info('===== Export: Subscribers =====')
 
@@ -88,11 +154,10 @@ class ExportSubscribers(ExportUser):
         counter = 0
         for sub in tqdm(subscriptions, desc='Export subscribers'):
             username = clean_id(sub.subscriber_link)
-            if User.exists(username):
-                counter += 1
-                continue
-
-            if super().run(username):
+            self.export_user.ensure([username])
+            # User may be exported at the same time by issues export
+            user_index.wait([username])
+            if user_index.is_known(username):
                 counter += 1
 
         logging.info(f'Exported subscribers: {counter}/{len(subscriptions)}')
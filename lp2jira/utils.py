@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import contextlib
+import os
 import re
+import tempfile
+import types
 
 from lp2jira.config import config, lp
+from lp2jira.mapping import mappings
+from lp2jira.metrics import metrics
+
+# Temporary files are created with mode 0600, finished files get
+# the same mode as files created with open()
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
 
 
 def clean_id(item_id):
@@ -17,44 +29,17 @@ def get_owner(person_link):
 
 
 def translate_status(status):
-    with open(config['mapping']['issue'], 'r') as f:
-        mapping = json.load(f)
-    try:
-        return mapping[status.title()]
-    except KeyError:
-        return status
+    return mappings.lookup('issue', status.title(), status)
 
 
 def translate_priority(priority):
-    with open(config['mapping']['priority'], 'r') as f:
-        mapping = json.load(f)
-    try:
-        return mapping[priority.title()]
-    except KeyError:
-        return priority
+    return mappings.lookup('priority', priority.title(), priority)
 
 
 def translate_blueprint_status(spec):
-    with open(config['mapping']['blueprint'], 'r') as f:
-        mapping = json.load(f)
-
-    for mapp in mapping:
-        result = []
-        for condition, value in mapp['conditions'].items():
-            try:
-                if isinstance(value, str):
-                    value = value.lower()
-
-                spec_v = getattr(spec, condition)
-                if isinstance(spec_v, str):
-                    spec_v = spec_v.lower()
-
-                result.append(value == spec_v)
-            except AttributeError as exc:
-                logging.error(f'Blueprint does not have attribute: "{condition}"')
-                logging.exception(exc)
-        if all(result):
-            return mapp['status']
+    for rule, status in mappings.get('blueprint'):
+        if rule(spec):
+            return status
     logging.error(f'Status cannot be mapped to blueprint: {spec.title}')
     return config['mapping']['blueprint_default']
 
@@ -80,9 +65,7 @@ def get_user_groups():
 
 
 def get_custom_fields():
-    with open(config['mapping']['custom_fields'], 'r') as f:
-        mapping = json.load(f)
-    return mapping
+    return mappings.get('custom_fields')
 
 
 def convert_custom_field_type(field_type, value):
@@ -107,6 +90,80 @@ def json_dump(data, file):
     json.dump(data, file, indent=2, sort_keys=True)
 
 
+def json_dump_stream(data, file, level=0):
+    # Writes the same output as json_dump, but generators are written
+    # item by item, so they never have to be kept in memory.
+    # Items yielded by generators are written as plain values.
+    indent = '  ' * (level + 1)
+    if isinstance(data, dict) and data:
+        separator = '{'
+        for key in sorted(data):
+            file.write(f'{separator}\n{indent}{json.dumps(key)}: ')
+            json_dump_stream(data[key], file, level + 1)
+            separator = ','
+        file.write(f'\n{indent[2:]}}}')
+    elif isinstance(data, (list, types.GeneratorType)):
+        streamed = isinstance(data, types.GeneratorType)
+        separator = '['
+        for item in data:
+            file.write(f'{separator}\n{indent}')
+            if streamed:
+                _json_dump_value(item, file, level + 1)
+            else:
+                json_dump_stream(item, file, level + 1)
+            separator = ','
+        file.write('[]' if separator == '[' else f'\n{indent[2:]}]')
+    else:
+        _json_dump_value(data, file, level)
+
+
+class RawJSON(str):
+    # Value already rendered by json_render, written as is by json_dump_stream
+    pass
+
+
+def json_render(data):
+    return RawJSON(json.dumps(data, indent=2, sort_keys=True))
+
+
+def _json_dump_value(data, file, level):
+    text = data if isinstance(data, RawJSON) else json.dumps(data, indent=2, sort_keys=True)
+    file.write(text.replace('\n', '\n' + '  ' * level) if level else text)
+
+
+def json_dump_compact(data, file):
+    # json.dumps uses C encoder, json.dump never does
+    file.write(json.dumps(data, separators=(',', ':')))
+
+
+def json_dump_file(data, filename):
+    # Writes intermediate issue or user file in configured format.
+    # Other workers may write the same file at the same time,
+    # readers only ever see complete files.
+    dump = json_dump_compact if config['intermediate']['format'] == 'compact' else json_dump
+    with metrics.timer('json_dump'), atomic_write(filename, 'w') as f:
+        dump(data, f)
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb', suffix='.tmp'):
+    # Writes to temporary file in the same directory and renames it
+    # when complete, temporary file is removed when writing fails
+    directory = os.path.dirname(filename) or '.'
+    f = tempfile.NamedTemporaryFile(mode, dir=directory, prefix='.', suffix=suffix, delete=False)
+    try:
+        with f:
+            yield f
+        os.chmod(f.name, FILE_MODE)
+        os.replace(f.name, filename)
+    except BaseException:
+        try:
+            os.unlink(f.name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 def prepare_attachment_name(name):
     for old in [':', ' ']:
         name = name.replace(old, '_')
@@ -127,7 +184,8 @@ def get_user_data_from_activity_changed(value):
 
 def bug_id(bug_task, target_name=None):
     if target_name is None:
-        bug_id = f"{bug_task.bug_target_name[:3]}/{bug_task.bug.id}"
+        # Bug number is taken from link, bug itself is not fetched
+        bug_id = f"{bug_task.bug_target_name[:3]}/{bug_task.bug_link.rstrip('/').split('/')[-1]}"
     else:
         bug_id = f"{target_name[:3]}/{bug_task.id}"
 
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from lp2jira.config import config
+from lp2jira.issue import UpdateBugs
+from lp2jira.jira import JiraClient, JiraIndex
+
+ID_FIELD = 'customfield_10010'
+ISSUE_JSON = re.compile(r'^/si/com\.atlassian\.jira\.plugins\.jira-importers-plugin:issue-json/'
+                        r'(?P<key>[^/]+)/(?P=key)\.json$')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubJira:
+    # JIRA search and issue-json endpoints served from memory. Responses
+    # queued in failures are sent before real ones.
+    def __init__(self, issues=(), max_results=50):
+        self.issues = {issue['projects'][0]['issues'][0]['key']: issue for issue in issues}
+        self.max_results = max_results
+        self.failures = []
+        self.requests = []
+        self.ports = set()
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests.append(self.path)
+                    stub.ports.add(self.client_address[1])
+                    failure = stub.failures.pop(0) if stub.failures else None
+                if failure is not None:
+                    status, headers = failure
+                    return self.send(status, {}, headers)
+                status, body = stub.handle(self.path)
+                self.send(status, body)
+
+            def send(self, status, body, headers=()):
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, path):
+        parts = urlsplit(path)
+        if parts.path == '/rest/api/2/search':
+            return 200, self.search(parse_qs(parts.query))
+        match = ISSUE_JSON.match(parts.path)
+        if match and match.group('key') in self.issues:
+            return 200, self.issues[match.group('key')]
+        return 404, {'errorMessages': ['Not found']}
+
+    def search(self, query):
+        jql = query['jql'][0]
+        start = int(query.get('startAt', ['0'])[0])
+        size = min(int(query.get('maxResults', [self.max_results])[0]), self.max_results)
+        hits = []
+        for key, issue in sorted(self.issues.items()):
+            external_id = self.external_id(issue)
+            field = re.match(r'cf\[\d+\]~(.*)', jql)
+            if field is None or external_id.split('/')[-1] == field.group(1):
+                hits.append({'key': key, 'fields': {ID_FIELD: external_id}})
+        return {'startAt': start, 'maxResults': size, 'total': len(hits),
+                'issues': hits[start:start + size]}
+
+    @staticmethod
+    def external_id(issue):
+        return issue['projects'][0]['issues'][0]['customFieldValues'][0]['value']
+
+
+def jira_issue(key, external_id, status='Open', updated=0, comments=(), history=()):
+    return {
+        'users': [{'name': 'jira-user'}],
+        'links': [],
+        'projects': [{
+            'versions': [{'name': '1.0'}],
+            'issues': [{
+                'key': key, 'externalId': external_id, 'issueType': 'Bug', 'status': status,
+                'summary': 'JIRA summary', 'updated': updated,
+                'comments': list(comments), 'history': list(history),
+                'customFieldValues': [{'fieldName': ID_FIELD, 'value': external_id}],
+            }],
+        }],
+    }
+
+
+def lp_issue(external_id, status='New', updated='2017-03-01T00:00:00+00:00',
+             comments=(), history=()):
+    return {'externalId': external_id, 'issueType': 'Bug', 'status': status,
+            'summary': f'Launchpad summary {external_id}', 'updated': updated,
+            'comments': list(comments), 'history': list(history)}
+
+
+@pytest.fixture
+def stub():
+    stub = StubJira()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def jira_config(monkeypatch, tmp_path, stub):
+    values = {
+        'jira': {'server': stub.url, 'username': 'user', 'password': 'secret', 'workers': '4',
+                 'retries': '3', 'backoff': '0', 'timeout': '5', 'bulk_lookup': 'true',
+                 'page_size': '2', 'index': str(tmp_path / 'jira_index.json'),
+                 'index_max_age': '0', 'issues': 'export.json', 'update': 'update.json'},
+        'local': {'export': str(tmp_path)},
+        'intermediate': {'store': 'files'},
+    }
+    for section, options in values.items():
+        for name, value in options.items():
+            monkeypatch.setitem(config[section], name, value)
+    return tmp_path
+
+
+def write_export(directory, issues):
+    with open(directory / 'export.json', 'w') as f:
+        json.dump({'users': [], 'links': [], 'projects': [{'issues': issues}]}, f)
+
+
+def test_retry_on_rate_limit_with_retry_after(jira_config, stub):
+    stub.issues = {'OPC-1': jira_issue('OPC-1', 'OPC/1')}
+    stub.failures = [(429, [('Retry-After', '1')]), (503, []), (500, [])]
+    client = JiraClient()
+
+    started = time.monotonic()
+    result = client.search('cf[10010]~1')
+    assert time.monotonic() - started >= 1
+    assert [issue['key'] for issue in result['issues']] == ['OPC-1']
+    assert len(stub.requests) == 4
+
+
+def test_retries_exhausted(jira_config, stub):
+    stub.failures = [(503, [])] * 10
+    client = JiraClient()
+    with pytest.raises(requests.exceptions.RetryError):
+        client.search('project = "OPC"')
+    assert len(stub.requests) == 4
+
+
+def test_session_reuses_connections(jira_config, stub):
+    stub.issues = {f'OPC-{n}': jira_issue(f'OPC-{n}', f'OPC/{n}') for n in range(1, 9)}
+    client = JiraClient()
+
+    for key in stub.issues:
+        client.get_issue_json(key)
+    assert len(stub.ports) == 1
+
+    keys = sorted(stub.issues) * 5
+    results = list(client.map(client.get_issue_json, keys))
+    assert [issue['projects'][0]['issues'][0]['key'] for issue in results] == keys
+    assert len(stub.ports) <= client.workers
+
+
+def test_map_yields_results_in_order(jira_config):
+    client = JiraClient()
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        # Later items finish first
+        time.sleep(0.01 * (item % 4))
+        with lock:
+            running[0] -= 1
+        return item * 10
+
+    items = list(range(50, 0, -1))
+    assert list(client.map(work, items)) == [item * 10 for item in items]
+    assert running[1] <= client.workers
+
+
+def test_index_pages_with_server_max_results(jira_config, stub, monkeypatch):
+    # JIRA returns fewer issues per page than page_size asks for
+    monkeypatch.setitem(config['jira'], 'page_size', '10')
+    stub.max_results = 3
+    stub.issues = {f'OPC-{n}': jira_issue(f'OPC-{n}', f'OPC/{n}') for n in range(1, 9)}
+
+    index = JiraIndex(JiraClient(), ID_FIELD)
+    index.build()
+    assert index.keys == {f'OPC/{n}': f'OPC-{n}' for n in range(1, 9)}
+    assert len(stub.requests) == 3
+
+
+def test_update_end_to_end(jira_config, stub):
+    comment = {'body': 'old comment', 'author': 'lp-user',
+               'created': '2017-01-01T10:00:00.500000+00:00'}
+    new_comment = {'body': 'new comment', 'author': 'lp-user',
+                   'created': '2017-02-01T10:00:00+00:00'}
+    record = {'author': 'lp-user', 'created': '2017-01-01T10:00:00+00:00', 'items': []}
+    stub.issues = {
+        'OPC-1': jira_issue('OPC-1', 'OPC/1', updated=1483228800000,
+                            comments=[{'body': 'old comment', 'created': 1483264800000}],
+                            history=[{'author': 'lp-user', 'created': 1483264800000,
+                                      'items': []}]),
+        'OPC-2': jira_issue('OPC-2', 'OPC/2', updated=1514764800000),
+    }
+    write_export(jira_config, [
+        lp_issue('OPC/1', comments=[comment, new_comment], history=[record]),
+        lp_issue('OPC/2', updated='2017-01-01T00:00:00+00:00'),
+        lp_issue('OPC/3'),
+    ])
+
+    UpdateBugs().run()
+
+    with open(jira_config / 'update.json') as f:
+        update = json.load(f)
+    issues = update['projects'][0]['issues']
+    assert [issue.get('key', issue['externalId']) for issue in issues] == ['OPC-1', 'OPC/3']
+    updated = issues[0]
+    assert updated['summary'] == 'Launchpad summary OPC/1'
+    assert updated['comments'] == [new_comment]
+    assert updated['history'] == []
+    assert update['projects'][0]['versions'] == [{'name': '1.0'}]
+    assert update['users'] == [{'name': 'jira-user'}]
+
+    # Issues are found in index, only issue missing in JIRA is searched
+    searches = [parse_qs(urlsplit(path).query)['jql'][0] for path in stub.requests
+                if path.startswith('/rest/api/2/search')]
+    assert searches == ['project = "OPC" ORDER BY key', 'cf[10010]~3']
+
+
+def test_verify_update_end_to_end(jira_config, stub, capsys):
+    stub.issues = {
+        'OPC-1': jira_issue('OPC-1', 'OPC/1', status='Open'),
+        'OPC-2': jira_issue('OPC-2', 'OPC/2', status='Open'),
+    }
+    write_export(jira_config, [lp_issue('OPC/1', status='New'),
+                               lp_issue('OPC/2', status='Fix Released'),
+                               lp_issue('OPC/3')])
+
+    UpdateBugs().verify_update()
+
+    output = capsys.readouterr().out
+    assert 'Verified 1 of 3.' in output
+    assert '1 tickets could not be found in Jira.' in output
+    assert 'externalID: OPC/2 has incorrect status.' in output
+    assert 'Original Launchpad status: Fix Released, Jira status: Open.' in output
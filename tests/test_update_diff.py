@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import datetime
+import random
+
+import pytest
+
+from lp2jira.issue import UpdateBugs
+
+EPOCH = datetime.datetime(2017, 3, 1, tzinfo=datetime.timezone.utc)
+
+
+# Nested loop implementation replaced by keyed diff, kept as reference
+def old_clear_comments(update, lp_comments, jira_comments):
+    def has_comment(jira_comments, lp_comment):
+        for comment in jira_comments:
+            lp_created, jira_created = update.normalize_datetimes(lp_comment['created'],
+                                                                  comment['created'])
+            if not 'body' in comment:
+                return True
+            if comment['body'] == lp_comment['body'] and lp_created == jira_created:
+                return True
+        return False
+
+    return [comment for comment in lp_comments if not has_comment(jira_comments, comment)]
+
+
+def old_clear_history(update, lp_history, jira_history):
+    def has_record(jira_history, lp_record):
+        for record in jira_history:
+            lp_created, jira_created = update.normalize_datetimes(lp_record['created'],
+                                                                  record['created'])
+            if record['author'] == lp_record['author'] and lp_created == jira_created:
+                return True
+        return False
+
+    return [record for record in lp_history if not has_record(jira_history, record)]
+
+
+@pytest.fixture
+def update():
+    # Diff methods don't use configuration, JIRA or export file
+    return UpdateBugs.__new__(UpdateBugs)
+
+
+def lp_time(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def jira_time(seconds):
+    return int((EPOCH + datetime.timedelta(seconds=seconds)).timestamp() * 1000)
+
+
+def comments_fixture(rnd, count, bodyless=False):
+    created = [rnd.randrange(20) + rnd.random() for _ in range(count)]
+    lp_comments = [{'body': f'comment {rnd.randrange(5)}', 'author': 'lp-user',
+                    'created': lp_time(seconds)} for seconds in created]
+    jira_comments = []
+    for index in rnd.sample(range(count), count // 2):
+        # Copies of Launchpad comments, some moved by a second
+        jira_comments.append({'body': lp_comments[index]['body'], 'author': 'jira-user',
+                              'created': jira_time(int(created[index]) + rnd.choice([0, 0, 1]))})
+    jira_comments.extend({'body': f'comment {rnd.randrange(5)}',
+                          'created': jira_time(rnd.randrange(20))} for _ in range(3))
+    if bodyless:
+        jira_comments.insert(rnd.randrange(len(jira_comments) + 1),
+                             {'author': 'jira-user', 'created': jira_time(rnd.randrange(20))})
+    return lp_comments, jira_comments
+
+
+def history_fixture(rnd, count):
+    authors = ['alice', 'bob', 'carol']
+    lp_history = [{'author': rnd.choice(authors),
+                   'created': lp_time(rnd.randrange(20) + rnd.random()),
+                   'items': [{'field': 'status', 'to': str(n)}]} for n in range(count)]
+    jira_history = [{'author': rnd.choice(authors), 'created': jira_time(rnd.randrange(20)),
+                     'items': []} for _ in range(count)]
+    return lp_history, jira_history
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_clear_comments_same_as_nested_loops(update, seed):
+    rnd = random.Random(seed)
+    lp_comments, jira_comments = comments_fixture(rnd, rnd.randrange(1, 30),
+                                                  bodyless=seed % 5 == 0)
+    assert (update.clear_comments(lp_comments, jira_comments)
+            == old_clear_comments(update, lp_comments, jira_comments))
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_clear_history_same_as_nested_loops(update, seed):
+    rnd = random.Random(seed)
+    lp_history, jira_history = history_fixture(rnd, rnd.randrange(1, 30))
+    assert (update.clear_history(lp_history, jira_history)
+            == old_clear_history(update, lp_history, jira_history))
+
+
+def test_bodyless_jira_comment_matches_every_comment(update):
+    lp_comments = [{'body': 'first', 'created': lp_time(1)},
+                   {'body': 'second', 'created': lp_time(2)}]
+    jira_comments = [{'body': 'other', 'created': jira_time(5)},
+                     {'author': 'jira-user', 'created': jira_time(7)}]
+    assert update.clear_comments(lp_comments, jira_comments) == []
+    assert old_clear_comments(update, lp_comments, jira_comments) == []
+
+
+def test_empty_inputs(update):
+    comments = [{'body': 'first', 'created': lp_time(1)}]
+    history = [{'author': 'alice', 'created': lp_time(1), 'items': []}]
+    assert update.clear_comments([], []) == old_clear_comments(update, [], []) == []
+    assert (update.clear_comments(comments, [])
+            == old_clear_comments(update, comments, []) == comments)
+    assert update.clear_comments([], [{'created': jira_time(1)}]) == []
+    assert update.clear_history([], []) == old_clear_history(update, [], []) == []
+    assert update.clear_history(history, []) == old_clear_history(update, history, []) == history
+
+
+def test_timestamps_equal_below_one_second(update):
+    # Launchpad has microseconds, JIRA milliseconds, both are compared in whole seconds
+    lp_comments = [{'body': 'same', 'created': lp_time(10.9)},
+                   {'body': 'later', 'created': lp_time(11.2)}]
+    jira_comments = [{'body': 'same', 'created': jira_time(10.1)},
+                     {'body': 'later', 'created': jira_time(10.9)}]
+    expected = [lp_comments[1]]
+    assert update.clear_comments(lp_comments, jira_comments) == expected
+    assert old_clear_comments(update, lp_comments, jira_comments) == expected
+
+    lp_history = [{'author': 'alice', 'created': lp_time(3.999), 'items': []},
+                  {'author': 'alice', 'created': lp_time(4.001), 'items': []}]
+    jira_history = [{'author': 'alice', 'created': jira_time(3.5), 'items': []}]
+    expected = [lp_history[1]]
+    assert update.clear_history(lp_history, jira_history) == expected
+    assert old_clear_history(update, lp_history, jira_history) == expected